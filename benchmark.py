@@ -0,0 +1,166 @@
+"""
+Benchmark every render path and lookup of fretboard.py.
+
+Usage:
+    python benchmark.py                       # all roots, print a table
+    python benchmark.py --roots C --repeat 3  # quicker run
+    python benchmark.py --output run.json     # save the results
+    python benchmark.py --compare base.json   # show the change against a saved run
+
+Each operation reports latency percentiles (ms), throughput (calls/sec, i.e. diagrams/sec
+for the render paths) and the peak RSS of the process after it ran.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import fretboard
+
+
+# Function to get the peak resident set size of this process in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# Function to get a percentile from a sorted list of samples
+def percentile(samples, fraction):
+    index = min(len(samples) - 1, max(0, int(round(fraction * (len(samples) - 1)))))
+    return samples[index]
+
+# Function to time a list of calls, repeated a number of times
+def measure(name, calls, repeat):
+    """
+    Time every call in calls, repeat times over, and summarize the latencies.
+
+    :param name: Name of the operation.
+    :param calls: List of zero-argument functions, one per diagram or lookup.
+    :param repeat: Number of passes over calls.
+    :return: Dict with the count, latency percentiles in ms, calls per second and peak RSS.
+    """
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for call in calls:
+            start = time.perf_counter_ns()
+            call()
+            samples.append(time.perf_counter_ns() - start)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    to_ms = 1e-6
+    return {
+        'name': name,
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * to_ms, 4),
+        'p50_ms': round(percentile(samples, 0.50) * to_ms, 4),
+        'p90_ms': round(percentile(samples, 0.90) * to_ms, 4),
+        'p99_ms': round(percentile(samples, 0.99) * to_ms, 4),
+        'max_ms': round(samples[-1] * to_ms, 4),
+        'per_sec': round(len(samples) / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+# Function to build the list of benchmarked operations
+def operations(roots):
+    scales = fretboard.scale_registry.names()
+    chords = fretboard.chord_registry.names()
+
+    def uncached_init():
+        fretboard.clear_fretboard_cache()
+        fretboard.init_fretboard()
+
+    images = [fretboard.draw_arpeggio(None, root, 'maj7').image for root in fretboard.chromatic_scale[:8]]
+    height, width, channels = fretboard.export_shape({'root': 'C', 'scale': 'major'}, 'RGBA')
+    frame = bytearray(height * width * channels)
+    zones = [[zone[0], zone[1], zone[2], zone[3], 1, 6] for zone in fretboard.zones]
+
+    return [
+        ('init_fretboard (uncached)', [uncached_init] * 20),
+        ('init_fretboard', [fretboard.init_fretboard] * 200),
+        ('draw_scale', [lambda root=root, scale=scale: fretboard.draw_scale(None, root, scale)
+                        for root in roots for scale in scales]),
+        ('draw_black_scale', [lambda root=root, scale=scale: fretboard.draw_black_scale(None, root, scale)
+                              for root in roots for scale in scales]),
+        ('draw_arpeggio', [lambda root=root, chord=chord: fretboard.draw_arpeggio(None, root, chord)
+                           for root in roots for chord in chords]),
+        ('draw_arpeggio over draw_black_scale',
+         [lambda root=root, chord=chord: fretboard.draw_arpeggio(fretboard.draw_black_scale(None, root, 'harmonic_minor'), root, chord)
+          for root in roots for chord in chords]),
+        ('draw_arpeggios_zones', [lambda: fretboard.draw_arpeggios_zones(None, zones)] * 20),
+        ('find_voicings', [lambda root=root, chord=chord: sum(1 for _ in fretboard.find_voicings(root, chord))
+                           for root in roots for chord in chords]),
+        ('render_into (RGBA)', [lambda root=root, scale=scale: fretboard.render_into([{'root': root, 'scale': scale}], frame, 'RGBA')
+                                for root in roots for scale in scales]),
+        ('merge_images_grid (8)', [lambda: fretboard.merge_images_grid(images)] * 10),
+        ('merge_images_vertically (8)', [lambda: fretboard.merge_images_vertically(images)] * 10),
+        ('scale_patterns', [lambda scale=scale: fretboard.scale_patterns(scale) for scale in scales]),
+        ('scale_patterns (inversions)', [lambda scale=scale, axis=axis: fretboard.scale_patterns([scale, axis])
+                                         for scale in scales for axis in range(12)]),
+        ('identify_patterns (superset)', [lambda chord=chord: fretboard.identify_patterns(fretboard.chord_patterns(chord), match='superset')
+                                          for chord in chords]),
+        ('chord_patterns', [lambda chord=chord: fretboard.chord_patterns(chord) for chord in chords]),
+        ('chord_patterns (inversions)', [lambda chord=chord, axis=axis: fretboard.chord_patterns([chord, axis])
+                                         for chord in chords for axis in range(12)]),
+    ]
+
+# Function to run the whole benchmark
+def run(roots, repeat, only=None):
+    # Warm up the font and the caches so the first sample is not an outlier
+    fretboard.draw_scale(None, 'C', 'major')
+    results = []
+    for name, calls in operations(roots):
+        if only and not any(word in name for word in only):
+            continue
+        results.append(measure(name, calls, repeat))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'roots': roots,
+        'repeat': repeat,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+# Function to print the results as a table, with the change against a baseline run if given
+def print_report(report, baseline=None):
+    previous = {result['name']: result for result in (baseline or {}).get('results', [])}
+    header = f"{'operation':40} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'per sec':>10} {'rss MB':>8}"
+    if previous:
+        header += f" {'p50 change':>11}"
+    print(header)
+    for result in report['results']:
+        line = (f"{result['name']:40} {result['count']:>7} {result['p50_ms']:>9.3f} {result['p90_ms']:>9.3f} "
+                f"{result['p99_ms']:>9.3f} {result['per_sec']:>10.1f} {result['peak_rss_mb'] or 0:>8.1f}")
+        old = previous.get(result['name'])
+        if old and old['p50_ms']:
+            line += f" {(result['p50_ms'] / old['p50_ms'] - 1) * 100:>+10.1f}%"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roots', nargs='+', default=fretboard.chromatic_scale, help='Root notes to render (default: all 12).')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of passes over each operation.')
+    parser.add_argument('--only', nargs='+', help='Only run operations whose name contains one of these words.')
+    parser.add_argument('--output', help='Save the results as JSON to this file.')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against.')
+    args = parser.parse_args()
+
+    report = run(args.roots, args.repeat, args.only)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
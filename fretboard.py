@@ -1,114 +1,775 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+from collections import OrderedDict, namedtuple
+from functools import lru_cache, wraps
+from bisect import bisect_left, bisect_right
+from html import escape
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
 import random
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# NumPy is optional: with it, note masks for whole patterns are computed as arrays.
+# It is imported on first use (see _require_numpy) so importing this module stays fast.
+np = None
+
+# Per-phase render timings, collected only while enabled (see enable_instrumentation)
+class Instrumentation:
+    """
+    Call counts and cumulative wall time per render phase.
 
-# Define the tuning for a 7-string guitar (from lowest to highest string)
-tuning = ['E', 'A', 'D', 'G', 'B', 'E']
-num_strings = len(tuning)
+    Phases nest (init_fretboard includes neck, draw_note includes note_sprite, ...), so
+    their times overlap rather than add up. Stats are per process: batch workers keep
+    their own.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counts = {}
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, elapsed):
+        with self._lock:
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+            self.times[phase] = self.times.get(phase, 0.0) + elapsed
+        if self.callback is not None:
+            self.callback(phase, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.times.clear()
+
+    def as_dict(self):
+        """
+        Return {phase: {'count', 'total_ms', 'mean_ms'}}, slowest phase first.
+        """
+        with self._lock:
+            return {phase: {'count': self.counts[phase],
+                            'total_ms': round(self.times[phase] * 1000, 3),
+                            'mean_ms': round(self.times[phase] * 1000 / self.counts[phase], 4)}
+                    for phase in sorted(self.times, key=self.times.get, reverse=True)}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+_instrumentation = None
+
+# Function to start recording per-phase render timings
+def enable_instrumentation(callback=None):
+    """
+    :param callback: Optional function called as callback(phase, seconds) after every timed call.
+    :return: The Instrumentation object collecting the stats.
+    """
+    global _instrumentation
+    _instrumentation = Instrumentation(callback)
+    return _instrumentation
+
+# Function to stop recording render timings; returns the collected stats as a dict
+def disable_instrumentation():
+    global _instrumentation
+    stats, _instrumentation = _instrumentation, None
+    return stats.as_dict() if stats is not None else {}
+
+# Decorator that times a function as a render phase while instrumentation is enabled
+def instrumented(phase):
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _instrumentation
+            if stats is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.record(phase, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+class _PhaseTimer:
+    __slots__ = ('stats', 'phase', 'start')
+
+    def __init__(self, stats, phase):
+        self.stats, self.phase = stats, phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.record(self.phase, time.perf_counter() - self.start)
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_timer = _NoTimer()
+
+# Function to time a block of code as a render phase: with timed_phase('encode'): ...
+def timed_phase(phase):
+    stats = _instrumentation
+    return _no_timer if stats is None else _PhaseTimer(stats, phase)
 
 # Define the notes in a chromatic scale
 chromatic_scale = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
-# Define frets that have position markers (dots)
-position_marker_frets = [3, 5, 7, 9, 12, 15, 17, 19, 21, 24]
-
-# Set up image dimensions
-fretboard_width = 1300
-border_thickness = 50
-string_spacing = 30
-fretboard_height = string_spacing * (num_strings + 1)
-fret_spacing = fretboard_width // 25
+# Map each note name to its pitch class (index in the chromatic scale)
+note_to_index = {note: index for index, note in enumerate(chromatic_scale)}
 
 # Function to get the note at a specific fret
 def note_at_fret(tuning_note, fret):
-    note_index = chromatic_scale.index(tuning_note)
-    return chromatic_scale[(note_index + fret) % 12]
+    return chromatic_scale[(note_to_index[tuning_note] + fret) % 12]
+
+# Limits of the instrument settings, so a spec sent by a client cannot ask for a huge canvas
+max_pixel_scale = 8
+max_image_pixels = 40_000_000  # Width times height of one diagram
+max_strings = 12
+max_frets = 36
+
+# A fretted instrument and the geometry of its diagram
+class Instrument:
+    """
+    Tuning, number of frets and diagram geometry of a fretted instrument.
+
+    The note grid and the pixel coordinates of every fret, note and string are computed
+    once here, so the draw functions only index tables. Instruments are immutable and
+    hashable (by their settings), so any number of them can be used side by side.
+    Settings are range-checked (see max_strings, max_frets, max_pixel_scale and
+    max_image_pixels), since instruments can come from client specs.
+    """
+    def __init__(self, tuning=('E', 'A', 'D', 'G', 'B', 'E'), num_frets=24, fretboard_width=1300,
+                 border_thickness=50, string_spacing=30, position_marker_frets=(3, 5, 7, 9, 12, 15, 17, 19, 21, 24),
+                 pixel_scale=1):
+        """
+        :param tuning: Open string notes, from the lowest to the highest string.
+        :param num_frets: Number of frets (the open string is drawn as an extra position).
+        :param fretboard_width: Width of the neck in pixels (at pixel_scale 1).
+        :param border_thickness: Black frame around the neck in pixels (at pixel_scale 1).
+        :param string_spacing: Distance between strings in pixels (at pixel_scale 1).
+        :param position_marker_frets: Frets with a dot (two dots on the 12th).
+        :param pixel_scale: Resolution factor applied to every length, line width and font size,
+                            e.g. 4 for print. Diagrams are drawn natively at that size, not upscaled.
+        """
+        for note in tuning:
+            if note not in note_to_index:
+                raise ValueError(f"Unknown tuning note '{note}'.")
+        if not 1 <= len(tuning) <= max_strings:
+            raise ValueError(f"An instrument needs 1 to {max_strings} strings.")
+        for name, value, low, high in (('num_frets', num_frets, 1, max_frets),
+                                       ('fretboard_width', fretboard_width, num_frets + 1, None),
+                                       ('border_thickness', border_thickness, 0, None),
+                                       ('string_spacing', string_spacing, 1, None)):
+            if not isinstance(value, int) or value < low or (high is not None and value > high):
+                raise ValueError(f"{name} must be an integer from {low}" + (f" to {high}." if high else " up."))
+        if not all(isinstance(fret, int) for fret in position_marker_frets):
+            raise ValueError("The position marker frets must be integers.")
+        if not isinstance(pixel_scale, (int, float)) or not 0 < pixel_scale <= max_pixel_scale:
+            raise ValueError(f"The pixel scale must be above 0 and at most {max_pixel_scale}.")
+        self.settings = {'tuning': tuple(tuning), 'num_frets': num_frets, 'fretboard_width': fretboard_width,
+                         'border_thickness': border_thickness, 'string_spacing': string_spacing,
+                         'position_marker_frets': tuple(position_marker_frets)}
+        self.pixel_scale = pixel_scale
+        px = self.px
+        self.tuning = tuple(tuning)
+        self.num_strings = len(self.tuning)
+        self.num_frets = num_frets
+        self.num_positions = num_frets + 1  # Including the open string
+        self.fretboard_width = fretboard_width = px(fretboard_width)
+        self.border_thickness = border_thickness = px(border_thickness)
+        self.string_spacing = string_spacing = px(string_spacing)
+        self.fretboard_height = string_spacing * (self.num_strings + 1)
+        self.fret_spacing = fretboard_width // self.num_positions
+        self.image_size = (fretboard_width + 2 * border_thickness, self.fretboard_height + 2 * border_thickness)
+        if self.image_size[0] * self.image_size[1] > max_image_pixels:
+            raise ValueError(f"The diagram would be {self.image_size[0]}x{self.image_size[1]} pixels, "
+                             f"more than max_image_pixels ({max_image_pixels}).")
+        self.position_marker_frets = tuple(fret for fret in position_marker_frets if fret <= num_frets)
+        self.note_radius = px(12)
+        self.marker_radius = px(10)
+
+        # Pitch class (0-11) at each fret of each string; chromatic_scale[pitch] gives the note name
+        self.grid = tuple(tuple((note_to_index[note] + fret) % 12 for fret in range(self.num_positions))
+                          for note in self.tuning)
+
+        # Coordinates: fret lines, note centres (middle of each fret) and strings (lowest at the bottom)
+        self.fret_x = tuple(border_thickness + fret * self.fret_spacing for fret in range(self.num_positions))
+        self.note_x = tuple(x + self.fret_spacing // 2 for x in self.fret_x)
+        self.string_y = tuple(border_thickness + (self.num_strings - string) * string_spacing
+                              for string in range(self.num_strings))
+
+        self.key = (self.tuning, num_frets, fretboard_width, border_thickness, string_spacing, self.position_marker_frets)
+        if pixel_scale != 1:
+            self.key += (pixel_scale,)
+
+    def __eq__(self, other):
+        return isinstance(other, Instrument) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Instrument(tuning={list(self.tuning)}, num_frets={self.num_frets})"
+
+    def note_center(self, string_index, fret):
+        return self.note_x[fret], self.string_y[string_index]
+
+    def px(self, length):
+        """
+        Scale a length given in pixels at pixel_scale 1.
+        """
+        return length if self.pixel_scale == 1 else int(round(length * self.pixel_scale))
+
+    def scaled(self, pixel_scale):
+        """
+        Return the same instrument drawn at another pixel scale.
+        """
+        if pixel_scale == self.pixel_scale:
+            return self
+        return Instrument(pixel_scale=pixel_scale, **self.settings)
+
+    def font(self):
+        # Scaled from the module fontsize at call time, so changing fontsize still applies
+        return get_font(self.px(fontsize))
+
+# Common instruments; any other can be built with Instrument(...)
+instruments = {
+    'guitar': Instrument(),
+    'guitar7': Instrument(tuning=('B', 'E', 'A', 'D', 'G', 'B', 'E')),
+    'baritone': Instrument(tuning=('B', 'E', 'A', 'D', 'F#', 'B'), num_frets=27),
+    'bass': Instrument(tuning=('E', 'A', 'D', 'G'), num_frets=24),
+    'bass5': Instrument(tuning=('B', 'E', 'A', 'D', 'G'), num_frets=24),
+}
+
+# Instrument used when a draw function is not given one (6-string guitar in standard tuning)
+default_instrument = instruments['guitar']
+
+# Function to get an instrument from an Instrument, a preset name or a dict of settings
+def get_instrument(instrument=None):
+    if instrument is None:
+        return default_instrument
+    if isinstance(instrument, Instrument):
+        return instrument
+    if isinstance(instrument, str):
+        if instrument not in instruments:
+            raise ValueError(f"Unknown instrument '{instrument}'.")
+        return instruments[instrument]
+    return Instrument(**instrument)
+
+# Module-level views of the default instrument (kept for existing code)
+tuning = list(default_instrument.tuning)
+num_strings = default_instrument.num_strings
+position_marker_frets = list(default_instrument.position_marker_frets)
+fretboard_width = default_instrument.fretboard_width
+border_thickness = default_instrument.border_thickness
+string_spacing = default_instrument.string_spacing
+fretboard_height = default_instrument.fretboard_height
+fret_spacing = default_instrument.fret_spacing
+fretboard = [list(string_notes) for string_notes in default_instrument.grid]
+
+# Function to convert a pattern (list of semitones or 12-bit mask) to a pitch-class bitmask
+def pattern_mask(pattern):
+    if isinstance(pattern, int):
+        return pattern & 0xFFF
+    mask = 0
+    for interval in pattern:
+        mask |= 1 << (interval % 12)
+    return mask
+
+@lru_cache(maxsize=4096)
+def _interval_positions(pattern):
+    if isinstance(pattern, int):
+        intervals = [interval for interval in range(12) if pattern >> interval & 1]
+    else:
+        intervals = pattern
+    positions = [None] * 12
+    for position, interval in enumerate(intervals):
+        if positions[interval % 12] is None:
+            positions[interval % 12] = position
+    return tuple(positions)
+
+# Function to build the pitch class -> pattern position lookup table for a root
+def interval_table(root_note, pattern):
+    """
+    Build a lookup table that matches frets against a scale or chord in constant time.
+
+    Parameters:
+    root_note (str or int): Root note name or pitch class.
+    pattern (list or int): Semitones from the root, or a 12-bit pitch-class mask relative to the root.
+
+    Returns:
+    tuple: 12 entries indexed by absolute pitch class. Each entry is the position of that
+    interval in the pattern (first occurrence, octaves folded), or None if it is not part of it.
+    For a bitmask, positions count the set bits from the root upwards.
+    """
+    root_index = root_note if isinstance(root_note, int) else note_to_index[root_note]
+    return _rotated_positions(root_index % 12, pattern if isinstance(pattern, int) else tuple(pattern))
+
+@lru_cache(maxsize=4096)
+@instrumented('pattern_match')
+def _rotated_positions(root_index, pattern):
+    positions = _interval_positions(pattern)
+    return tuple(positions[(pitch - root_index) % 12] for pitch in range(12))
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("This function needs NumPy (pip install numpy).") from None
+        np = numpy
+    return np
+
+@lru_cache(maxsize=16)
+def _pitch_class_array(tuning_key, num_frets):
+    grid = (np.array([note_to_index[note] for note in tuning_key], dtype=np.int8)[:, None]
+            + np.arange(num_frets, dtype=np.int8)) % 12
+    grid.flags.writeable = False  # Shared by every caller
+    return grid
+
+@lru_cache(maxsize=4096)
+def _interval_array(positions):
+    table = np.array([-1 if position is None else position for position in positions], dtype=np.int8)
+    table.flags.writeable = False
+    return table
+
+# Function to get the fretboard as a NumPy array of pitch classes
+def fretboard_array(instrument=None):
+    """
+    Return the fretboard as a read-only (num_strings, num_frets) int8 array of pitch classes.
+    """
+    _require_numpy()
+    instrument = get_instrument(instrument)
+    return _pitch_class_array(instrument.tuning, instrument.num_positions)
+
+# Function to compute the highlight mask of a pattern over the whole fretboard
+def pattern_mask_array(root_note, pattern, instrument=None):
+    """
+    Match every fret against a scale or chord in one vectorized lookup.
+
+    Parameters:
+    root_note (str or int): Root note name or pitch class.
+    pattern (list or int): Semitones from the root, or a 12-bit pitch-class mask (see interval_table).
+
+    Returns:
+    tuple: (mask, intervals), both shaped (num_strings, num_frets). mask is True where the fret
+    belongs to the pattern; intervals holds the position in the pattern, or -1.
+    """
+    _require_numpy()
+    intervals = _interval_array(interval_table(root_note, pattern))[fretboard_array(instrument)]
+    return intervals >= 0, intervals
+
+# Function to compute the masks of many (root, pattern) pairs at once
+def pattern_mask_arrays(pairs, instrument=None):
+    """
+    Stacked version of pattern_mask_array for a list of (root_note, pattern) pairs.
+
+    Returns:
+    tuple: (masks, intervals), both shaped (len(pairs), num_strings, num_frets).
+    """
+    _require_numpy()
+    tables = np.stack([_interval_array(interval_table(root_note, pattern)) for root_note, pattern in pairs])
+    intervals = tables[:, fretboard_array(instrument)]
+    return intervals >= 0, intervals
+
+# Function to find the frets shared by every chord (or scale) of a progression
+def common_frets(pairs, instrument=None):
+    """
+    Return a (num_strings, num_frets) bool mask of the frets whose note is in every (root_note, pattern) pair.
+    """
+    return pattern_mask_arrays(pairs, instrument)[0].all(axis=0)
 
-# Generate the notes for each string
-fretboard = []
-for string in tuning:
-    fretboard.append([note_at_fret(string, fret) for fret in range(25)])  # 25 positions including open string
+def _clip_range(values, size):
+    if values is None:
+        return range(size)
+    return range(max(values.start, 0), min(values.stop, size))
 
-# Load a font
+# Function to list the frets of the fretboard that belong to a pattern
+@instrumented('pattern_match')
+def note_positions(root_note, pattern, strings=None, frets=None, instrument=None):
+    """
+    List (string_index, fret, pitch, interval_index) for every fret that belongs to the pattern,
+    string by string from the lowest string.
+
+    Parameters:
+    root_note (str or int): Root note name or pitch class.
+    pattern (list or int): Semitones from the root, or a 12-bit pitch-class mask.
+    strings (range): Optional string indexes to restrict the search to (clipped to the fretboard).
+    frets (range): Optional frets to restrict the search to (clipped to the fretboard).
+    instrument (Instrument): Instrument to search (defaults to default_instrument).
+    """
+    # A single 6x25 board is too small for NumPy to pay off (array setup costs more than
+    # the lookups), so drawing uses the lookup table; the array functions are for analysis.
+    grid = get_instrument(instrument).grid
+    positions = interval_table(root_note, pattern)
+    return [(string_index, fret, grid[string_index][fret], positions[grid[string_index][fret]])
+            for string_index in _clip_range(strings, len(grid))
+            for fret in _clip_range(frets, len(grid[0]))
+            if positions[grid[string_index][fret]] is not None]
+
+# Font settings (the font itself is loaded lazily by get_font(), so changing them applies to later renders)
 fontsize = 16
-font = ImageFont.truetype('Arial.ttf', fontsize)
+font_path = 'Arial.ttf'
+fallback_fonts = ['DejaVuSans.ttf', 'LiberationSans-Regular.ttf', 'FreeSans.ttf', 'Helvetica.ttc']
+font = None  # Set to a Pillow font to use it instead of font_path at fontsize
 # font = ImageFont.load_default()
 
+# Function to load a font at a size once per process, falling back to other fonts if it is missing
+@lru_cache(maxsize=32)
+def load_font(size=None, path=None):
+    """
+    Load a TrueType font, trying path (or font_path), then every entry of fallback_fonts,
+    then Pillow's built-in font.
+
+    :param size: Font size in pixels (defaults to fontsize).
+    :param path: Font file to try first (defaults to font_path).
+    """
+    size = size or fontsize
+    for candidate in [path or font_path] + fallback_fonts:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+_font_lock = threading.Lock()
+
+# Function to get the font at a size, loading it the first time it is needed
+def get_font(size=None):
+    """
+    Fonts are loaded once per (size, font_path) and then only read (measured and rasterized),
+    so every thread shares the same font objects. The settings are read on every call, so a
+    new fontsize or font_path applies to the next render.
+
+    :param size: Font size in pixels (defaults to fontsize).
+    """
+    size = size or fontsize
+    if font is not None and size == fontsize:
+        return font
+    # The lock makes concurrent first calls share one font object
+    with _font_lock:
+        return load_font(size, font_path)
+
+# Function to measure text, cached by (font, size, text)
+def text_bbox(text, font=None):
+    """
+    Return the ink bounding box of text drawn at (0, 0), like draw.textbbox((0, 0), text, font=font).
+    """
+    font = font or get_font()
+    return _text_bbox(getattr(font, 'path', None), getattr(font, 'size', None), text, font)
+
+@lru_cache(maxsize=4096)
+def _text_bbox(path, size, text, font):
+    with timed_phase('text_measure'):
+        return font.getbbox(text)
+
+# Decorator for an lru_cache whose size is the module setting named setting, read on every call
+def sized_lru_cache(setting):
+    """
+    Like lru_cache, but the maximum size follows a module variable (e.g. note_sprite_cache_size),
+    so changing the setting applies at runtime; the cache starts empty again at the new size.
+    """
+    def decorator(function):
+        state = {'size': None, 'cached': None}
+
+        def cached():
+            size = globals()[setting]
+            if size != state['size']:
+                # Two threads may both rebuild it after a change, which is harmless
+                state['cached'], state['size'] = lru_cache(maxsize=size)(function), size
+            return state['cached']
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return cached()(*args, **kwargs)
+        wrapper.cache_clear = lambda: cached().cache_clear()
+        wrapper.cache_info = lambda: cached().cache_info()
+        return wrapper
+    return decorator
+
+# Pre-rasterized labels (fret numbers, tuning, note names, titles), keyed by text, colour, font and subpixel offset
+label_sprite_cache_size = 512
+
+@sized_lru_cache('label_sprite_cache_size')
+def label_sprite(text, fill, font, start=(0.0, 0.0)):
+    """
+    Render a text label as an RGBA sprite of the fill colour with the glyph coverage as alpha.
+
+    :param start: Fractional part of the text position, which Pillow uses for subpixel placement.
+    :return: (sprite, (dx, dy)) where (dx, dy) is the sprite's top-left corner relative to the
+             integer text position. Pasting the sprite with its own alpha gives the same pixels
+             as draw.text().
+    """
+    left, top, right, bottom = text_bbox(text, font)
+    # One extra pixel each way for the ink a fractional start can push over the edge
+    size = (right - left + 2, bottom - top + 2)
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).text((start[0] - left + 1, start[1] - top + 1), text, fill=255, font=font)
+    sprite = Image.new('RGBA', size, fill)
+    sprite.putalpha(mask)
+    return sprite, (left - 1, top - 1)
+
+# Function to draw a text label, pasting it from the label cache when the draw object has an image
+def draw_label(draw, xy, text, fill, font):
+    image = getattr(draw, 'image', None)
+    if image is None:
+        draw.text(xy, text, fill=fill, font=font)
+        return
+    x, y = xy
+    start = (x - int(x), y - int(y))
+    sprite, (dx, dy) = label_sprite(text, fill, font, start)
+    image.paste(sprite, (int(x) + dx, int(y) + dy), sprite)
+
+# Function to rasterize the fixed labels (note names and fret numbers) once, e.g. before forking workers
+def preload_labels(sizes=None, fill='white'):
+    """
+    Fill the font, metrics and label caches for the note names and the fret numbers of every instrument.
+
+    :param sizes: Font sizes to preload (defaults to fontsize).
+    """
+    max_frets = max(instrument.num_frets for instrument in instruments.values())
+    labels = chromatic_scale + [str(fret) for fret in range(max_frets + 1)]
+    for size in sizes or [fontsize]:
+        label_font = get_font(size)
+        for text in labels:
+            label_sprite(text, fill, label_font)
+
+# Pre-rendered note glyphs (circle + name), keyed by (note, fill colour, text colour, radius, font)
+note_sprite_cache_size = 256
+
+@sized_lru_cache('note_sprite_cache_size')
+@instrumented('note_sprite')
+def note_sprite(note, color, text, radius, font):
+    """
+    Render one note glyph as an RGBA sprite.
+
+    :return: (sprite, (dx, dy)) where (dx, dy) is the sprite's top-left corner relative
+             to the note centre. Pasting the sprite with its own alpha gives the same
+             pixels as drawing the ellipse and the text directly.
+    """
+    bbox = text_bbox(note, font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    text_x, text_y = -(text_width // 2), -text_height
+
+    # Bounds of the circle and the text ink, relative to the note centre
+    left = min(-radius, text_x + bbox[0])
+    top = min(-radius, text_y + bbox[1])
+    right = max(radius + 1, text_x + bbox[2])
+    bottom = max(radius + 1, text_y + bbox[3])
+    size = (right - left, bottom - top)
+    circle = [(-radius - left, -radius - top), (radius - left, radius - top)]
+    text_xy = (text_x - left, text_y - top)
+
+    # Text over the circle, blended exactly like draw.text does on the fretboard
+    glyph = Image.new('RGB', size, color)
+    ImageDraw.Draw(glyph).text(text_xy, note, fill=text, font=font)
+    circle_mask = Image.new('L', size, 0)
+    ImageDraw.Draw(circle_mask).ellipse(circle, fill=255)
+    text_mask = Image.new('L', size, 0)
+    ImageDraw.Draw(text_mask).text(text_xy, note, fill=255, font=font)
+
+    # Outside the circle only the antialiased text remains, with its coverage as alpha
+    sprite = Image.composite(glyph, Image.new('RGB', size, text), circle_mask).convert('RGBA')
+    sprite.putalpha(ImageChops.lighter(circle_mask, text_mask))
+    return sprite, (left, top)
+
+# Function to get the instrument a draw object was created for
+def draw_instrument(draw, instrument=None):
+    return getattr(draw, 'instrument', None) or get_instrument(instrument)
+
 # Function to draw notes on the fretboard
+@instrumented('draw_note')
 def draw_note_on_fretboard(draw, fretboard, string_index, fret, color, note, text = 'black'):
-    x = border_thickness + fret * fret_spacing + fret_spacing // 2
-    y = border_thickness + (num_strings - string_index) * string_spacing
-    radius = 12
+    # The fretboard argument can be the Instrument to draw on; otherwise the draw object's instrument is used
+    instrument = draw_instrument(draw, fretboard if isinstance(fretboard, Instrument) else None)
+    x, y = instrument.note_center(string_index, fret)
+    radius = instrument.note_radius
+    if isinstance(draw, SVGDraw):
+        draw.note(x, y, radius, color, note, text)
+        return
+    font = instrument.font()
+    image = getattr(draw, 'image', None)
+    if image is not None:
+        sprite, (dx, dy) = note_sprite(note, color, text, radius, font)
+        image.paste(sprite, (x + dx, y + dy), sprite)
+        return
+
     draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill=color)
     
-    # Use textbbox to calculate text width and height
-    text_bbox = draw.textbbox((0, 0), note, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
+    # Use the cached text metrics to calculate text width and height
+    bbox = text_bbox(note, font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
     
     # draw.text((x - text_width // 2, y - text_height // 2), note, fill='black', font=font)
     draw.text((x - text_width // 2, y - text_height), note, fill=text, font=font)
 
 
-def init_fretboard():
+# Cache of rendered base fretboards (neck, frets, strings, markers and labels).
+# Templates are keyed on the geometry, tuning and font, so changing any of them
+# renders a new template instead of reusing a stale one.
+fretboard_cache_size = 16  # Maximum number of templates kept (least recently used are dropped)
+_fretboard_cache = OrderedDict()
+_fretboard_cache_lock = threading.Lock()  # Templates are never modified, only the LRU order is
+
+def _fretboard_cache_key(instrument):
+    font = instrument.font()
+    return (instrument.key, getattr(font, 'path', id(font)), getattr(font, 'size', None))
+
+def clear_fretboard_cache():
+    """
+    Drop every cached fretboard template. The next call to init_fretboard() renders the neck again.
+    """
+    with _fretboard_cache_lock:
+        _fretboard_cache.clear()
+
+# Function to get the cached base fretboard of an instrument, converted to another image mode if needed
+def _fretboard_template(instrument, mode='RGB'):
+    key = _fretboard_cache_key(instrument) + (() if mode == 'RGB' else (mode,))
+    with _fretboard_cache_lock:
+        template = _fretboard_cache.get(key)
+        if template is not None:
+            _fretboard_cache.move_to_end(key)
+    if template is None:
+        # Rendered outside the lock; two threads may both render a missing template, which is harmless
+        template = _render_fretboard(instrument) if mode == 'RGB' else _fretboard_template(instrument).convert(mode)
+        with _fretboard_cache_lock:
+            _fretboard_cache[key] = template
+            while len(_fretboard_cache) > max(fretboard_cache_size, 1):
+                _fretboard_cache.popitem(last=False)
+    return template
+
+@instrumented('init_fretboard')
+def init_fretboard(instrument=None, backend='raster', canvas=None):
+    """
+    Return a fresh draw object on a copy of the base fretboard.
+
+    The neck is rendered once per instrument/font and kept in a small LRU cache;
+    every call hands out an independent Image.copy() with its own ImageDraw.
+
+    :param instrument: Instrument, preset name or dict of Instrument settings (defaults to default_instrument).
+    :param backend: 'raster' for a Pillow image, or 'svg' for an SVGDraw that emits vector markup.
+    :param canvas: Image of the fretboard's size to draw on instead of a copy (raster only); the
+                   neck is pasted into it. Used by render_into to draw straight into a caller's buffer.
+    """
+    instrument = get_instrument(instrument)
+    if backend == 'svg':
+        return SVGDraw(instrument)
+    if backend != 'raster':
+        raise ValueError(f"Unknown backend '{backend}'.")
+    template = _fretboard_template(instrument, 'RGB' if canvas is None else canvas.mode)
+    if canvas is not None:
+        if canvas.size != template.size:
+            raise ValueError(f"The canvas is {canvas.size}, the fretboard needs {template.size}.")
+        canvas.paste(template)
+        return FretboardDraw(canvas, instrument)
+    return FretboardDraw(template.copy(), instrument)
+
+# Draw object of one diagram: an ImageDraw that owns its image and knows its instrument
+class FretboardDraw(ImageDraw.ImageDraw):
+    """
+    ImageDraw over a diagram's own image, returned by init_fretboard() and by every draw_* function.
+
+    Each render gets a new one on a copy of the template, so renders (and threads) never
+    share a canvas; the image and the instrument are plain attributes.
+    """
+    def __init__(self, image, instrument):
+        super().__init__(image)
+        self.image = image
+        self.instrument = instrument
+
+    def copy(self):
+        return FretboardDraw(self.image.copy(), self.instrument)
+
+    def to_png(self, palette=False):
+        return encode_png(self.image, palette=palette)
+
+# Function to copy a diagram so more layers can be drawn on it without touching the original
+def copy_draw(draw):
+    if isinstance(draw, (FretboardDraw, SVGDraw)):
+        return draw.copy()
+    return FretboardDraw(draw.image.copy(), draw_instrument(draw))
+
+# Function to render the base fretboard without any notes
+@instrumented('neck')
+def _render_fretboard(instrument):
+    border = instrument.border_thickness
+    width, height = instrument.fretboard_width, instrument.fretboard_height
     # Create an image with a larger black background to frame the fretboard
-    image = Image.new('RGB', (fretboard_width + 2 * border_thickness, fretboard_height + 2 * border_thickness), color='black')
-    draw = ImageDraw.Draw(image)
+    image = Image.new('RGB', instrument.image_size, color='black')
+    draw = FretboardDraw(image, instrument)
+    font = instrument.font()
+    px = instrument.px
 
     # Draw the fretboard background in dark brown
-    draw.rectangle([border_thickness, border_thickness, border_thickness + fretboard_width, border_thickness + (fretboard_height)], fill='#150000')
+    draw.rectangle([border, border, border + width, border + height], fill='#150000')
 
     # Draw frets
-    for fret in range(25):  # 24 frets + the zero fret
-        x = border_thickness + fret * fret_spacing
-        line_width = 16 if fret == 1 else 2  # Zero fret thicker
-        draw.line([(x, border_thickness + 20), (x, border_thickness + fretboard_height - 20)], fill='darkgray', width=line_width)
+    for fret, x in enumerate(instrument.fret_x):  # All the frets + the zero fret
+        line_width = px(16) if fret == 1 else px(2)  # Zero fret thicker
+        draw.line([(x, border + px(20)), (x, border + height - px(20))], fill='darkgray', width=line_width)
 
     # Draw strings with varying thickness (low strings thicker, at the bottom)
-    for string in range(num_strings):  # 7 strings
-        y = border_thickness + (num_strings - string) * string_spacing
-        string_width = 6 if string == 0 else 4  # Thickest for the lowest string
-        draw.line([(border_thickness, y), (border_thickness + fretboard_width, y)], fill='lightgray', width=string_width)
+    for string, y in enumerate(instrument.string_y):
+        string_width = px(6) if string == 0 else px(4)  # Thickest for the lowest string
+        draw.line([(border, y), (border + width, y)], fill='lightgray', width=string_width)
 
     # Draw position markers (dots)
-    for fret in position_marker_frets:
-        x = border_thickness + fret * fret_spacing + fret_spacing // 2
+    radius = instrument.marker_radius
+    for fret in instrument.position_marker_frets:
+        x = instrument.note_x[fret]
         if fret == 12:
             # Draw two dots for the 12th fret
-            y1 = border_thickness + fretboard_height // 3
-            y2 = border_thickness + 2 * fretboard_height // 3
-            draw.ellipse([(x - 10, y1 - 10), (x + 10, y1 + 10)], fill='white')
-            draw.ellipse([(x - 10, y2 - 10), (x + 10, y2 + 10)], fill='white')
+            y1 = border + height // 3
+            y2 = border + 2 * height // 3
+            draw.ellipse([(x - radius, y1 - radius), (x + radius, y1 + radius)], fill='white')
+            draw.ellipse([(x - radius, y2 - radius), (x + radius, y2 + radius)], fill='white')
         else:
-            y = border_thickness + fretboard_height // 2
-            draw.ellipse([(x - 10, y - 10), (x + 10, y + 10)], fill='white')
+            y = border + height // 2
+            draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill='white')
 
     # Draw fret numbers above the fretboard
-    for fret in range(25):
-        x = border_thickness + fret * fret_spacing + fret_spacing // 2
+    for fret, x in enumerate(instrument.note_x):
         text = str(fret)
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        draw.text((x - text_width // 2, border_thickness - text_height - 15), text, fill='white', font=font)
+        bbox = text_bbox(text, font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        draw_label(draw, (x - text_width // 2, border - text_height - px(15)), text, 'white', font)
 
     # Draw string tuning on the left side outside the fretboard
-    for string in range(num_strings):
-        y = border_thickness + (num_strings - string) * string_spacing - string_spacing // 2
-        text = tuning[string]
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        draw.text((border_thickness - text_width - 20, (y - text_height) + 35 // 2), text, fill='white', font=font)
-    # Attach the image to the draw object
-    draw.image = image
-    return draw
+    for string, text in enumerate(instrument.tuning):
+        y = instrument.string_y[string] - instrument.string_spacing // 2
+        bbox = text_bbox(text, font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        draw_label(draw, (border - text_width - px(20), (y - text_height) + px(35) // 2), text, 'white', font)
+    return image
 
 # function to write a title in the image
+@instrumented('title')
 def fretboard_title(draw, title):
     if not title:
         return draw
+    if isinstance(draw, SVGDraw):
+        draw.title(title)
+        return draw
+    instrument = draw_instrument(draw)
+    font = instrument.font()
     # Get the bounding box of the text
-    bbox = draw.textbbox((0, 0), title, font=font)
+    bbox = text_bbox(title, font)
 
     # Calculate the text width and height
     text_width = bbox[2] - bbox[0]
@@ -116,18 +777,325 @@ def fretboard_title(draw, title):
 
 
     # Calculate the position for the text to be centered
-    image_width, image_height = (fretboard_width + 2 * border_thickness, fretboard_height + 2 * border_thickness)
+    image_width, image_height = instrument.image_size
     text_x = (image_width - text_width) / 2
-    text_y = (image_height - text_height - 40)
+    text_y = (image_height - text_height - instrument.px(40))
 
     # Add the text to the image
-    draw.text((text_x, text_y), title, font=font, fill=(255, 255, 255))  # Adjust fill color as needed
+    draw_label(draw, (text_x, text_y), title, (255, 255, 255), font)  # Adjust fill color as needed
     return draw
 
+# Function to convert a Pillow colour (name, hex string or RGB tuple) to an SVG colour
+def _svg_color(color):
+    if isinstance(color, (tuple, list)):
+        return 'rgb({},{},{})'.format(*color[:3])
+    return color
+
+# Function to build the SVG neck template of an instrument (same layout as _render_fretboard)
+def svg_neck(instrument):
+    """
+    Return (neck_id, markup) for an instrument's neck as an SVG <g> to put in <defs>.
+    """
+    # Cached by font size too, like the raster templates, so a new fontsize applies
+    return _svg_neck(instrument, instrument.px(fontsize))
+
+@lru_cache(maxsize=16)
+def _svg_neck(instrument, font_size):
+    neck_id = 'neck-' + hashlib.sha1(repr(instrument.key).encode()).hexdigest()[:10]
+    border = instrument.border_thickness
+    px = instrument.px
+    width, height = instrument.fretboard_width, instrument.fretboard_height
+    image_width, image_height = instrument.image_size
+    parts = [f'<g id="{neck_id}" font-size="{font_size}">',
+             f'<rect width="{image_width}" height="{image_height}" fill="black"/>',
+             f'<rect x="{border}" y="{border}" width="{width}" height="{height}" fill="#150000"/>']
+    for fret, x in enumerate(instrument.fret_x):
+        line_width = px(16) if fret == 1 else px(2)
+        parts.append(f'<line x1="{x}" y1="{border + px(20)}" x2="{x}" y2="{border + height - px(20)}" stroke="darkgray" stroke-width="{line_width}"/>')
+    for string, y in enumerate(instrument.string_y):
+        string_width = px(6) if string == 0 else px(4)
+        parts.append(f'<line x1="{border}" y1="{y}" x2="{border + width}" y2="{y}" stroke="lightgray" stroke-width="{string_width}"/>')
+    radius = instrument.marker_radius
+    for fret in instrument.position_marker_frets:
+        x = instrument.note_x[fret]
+        marker_ys = [border + height // 3, border + 2 * height // 3] if fret == 12 else [border + height // 2]
+        for y in marker_ys:
+            parts.append(f'<circle cx="{x}" cy="{y}" r="{radius}" fill="white"/>')
+    parts.append(f'<g fill="white" text-anchor="middle">')
+    for fret, x in enumerate(instrument.note_x):
+        parts.append(f'<text x="{x}" y="{border - px(15)}">{fret}</text>')
+    parts.append('</g><g fill="white" text-anchor="end" dominant-baseline="central">')
+    for string, text in enumerate(instrument.tuning):
+        parts.append(f'<text x="{border - px(20)}" y="{instrument.string_y[string]}">{escape(text, quote=False)}</text>')
+    parts.append('</g></g>')
+    return neck_id, ''.join(parts)
+
+# Vector counterpart of the ImageDraw objects returned by init_fretboard()
+class SVGDraw:
+    """
+    Collect a diagram as SVG elements instead of rasterizing it.
+
+    Returned by init_fretboard(backend='svg') and accepted by the same drawing calls
+    (draw_note_on_fretboard, fretboard_title, draw_scale, draw_arpeggio, ...). The neck is
+    a shared <defs> template referenced with <use>, so a grid of diagrams carries it once.
+    """
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.size = instrument.image_size
+        self.width, self.height = self.size
+        self.elements = []
+        # The document sets the default font size; scaled diagrams set their own on each text
+        self._font_size = '' if instrument.pixel_scale == 1 else f' font-size="{instrument.px(fontsize)}"'
+
+    @property
+    def image(self):
+        # Mirrors draw.image on the raster backend; the SVG document is the draw object itself
+        return self
+
+    def note(self, x, y, radius, color, note, text='black'):
+        self.elements.append(
+            f'<circle cx="{x}" cy="{y}" r="{radius}" fill="{_svg_color(color)}"/>'
+            f'<text x="{x}" y="{y}" fill="{_svg_color(text)}"{self._font_size} text-anchor="middle" '
+            f'dominant-baseline="central">{escape(note, quote=False)}</text>')
+
+    def title(self, title):
+        self.elements.append(f'<text x="{self.width / 2}" y="{self.height - self.instrument.px(40)}" fill="white"{self._font_size} text-anchor="middle">{escape(title, quote=False)}</text>')
+
+    def copy(self):
+        duplicate = SVGDraw(self.instrument)
+        duplicate.elements = list(self.elements)
+        return duplicate
+
+    def body(self):
+        """
+        Return the markup of this diagram without the <svg> wrapper and the neck definition.
+        """
+        neck_id, _ = svg_neck(self.instrument)
+        return f'<use href="#{neck_id}"/>' + ''.join(self.elements)
+
+    def tostring(self):
+        return merge_svg_grid([self], columns=1)
+
+    def save(self, fp):
+        data = self.tostring().encode('utf-8')
+        if isinstance(fp, (str, os.PathLike)):
+            with open(fp, 'wb') as f:
+                f.write(data)
+        else:
+            fp.write(data)
+
+    def _repr_svg_(self):
+        return self.tostring()
+
+# Function to arrange SVG diagrams in a grid sharing one copy of each neck template
+@instrumented('merge')
+def merge_svg_grid(draws, columns=2):
+    """
+    Merge SVGDraw diagrams into one SVG document, with a fixed number of diagrams per row.
+
+    :param draws: Iterable of SVGDraw objects.
+    :param columns: Number of diagrams per row.
+    :return: The SVG document as a string.
+    """
+    if columns < 1:
+        raise ValueError("The number of columns must be at least 1.")
+    necks = {}
+    panels = []
+    total_width = total_height = row_width = row_height = 0
+    for index, draw in enumerate(draws):
+        if index % columns == 0:
+            total_height += row_height
+            row_width = row_height = 0
+        neck_id, neck = svg_neck(draw.instrument)
+        necks[neck_id] = neck
+        panels.append(f'<g transform="translate({row_width},{total_height})">{draw.body()}</g>')
+        row_width += draw.width
+        row_height = max(row_height, draw.height)
+        total_width = max(total_width, row_width)
+    if not panels:
+        raise ValueError("The image list cannot be empty.")
+    total_height += row_height
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{total_width}" height="{total_height}" '
+            f'viewBox="0 0 {total_width} {total_height}" font-family="Arial, Helvetica, sans-serif" font-size="{fontsize}">'
+            f'<defs>{"".join(necks.values())}</defs>{"".join(panels)}</svg>')
+
+# Registry of named interval patterns (chords or scales), built once at import
+class PatternRegistry:
+    """
+    Named semitone patterns with their inversions and pitch-class bitmasks precomputed.
+
+    Patterns are stored as tuples, so lookups never rebuild or copy anything. New patterns
+    can be added at runtime with register(); the version counter changes on every update
+    so dependent caches can tell when to rebuild.
+    """
+    def __init__(self, patterns=None):
+        self._patterns = {}
+        self._inversions = {}
+        self._modes = {}
+        self._masks = {}
+        self.version = 0
+        for name, intervals in (patterns or {}).items():
+            self.register(name, intervals)
+
+    def register(self, name, intervals):
+        """
+        Add or replace a pattern.
+
+        :param name: Name of the chord or scale.
+        :param intervals: Semitones from the root, e.g. [0, 4, 7].
+        """
+        intervals = tuple(int(interval) for interval in intervals)
+        if not intervals:
+            raise ValueError(f"Pattern '{name}' must contain at least one interval.")
+        self._patterns[name] = intervals
+        # Inversions around every axis: (2 * axis - note) % 12
+        self._inversions[name] = tuple(tuple((2 * axis - note) % 12 for note in intervals) for axis in range(12))
+        # Modes: the pattern rotated to start on each of its notes
+        self._modes[name] = tuple(tuple((note - start) % 12 for note in intervals[degree:] + intervals[:degree])
+                                  for degree, start in enumerate(intervals))
+        self._masks[name] = pattern_mask(intervals)
+        self.version += 1
+
+    @instrumented('pattern_lookup')
+    def lookup(self, input_value):
+        """
+        Return the frozen pattern for a name or a [name, axis] inversion, or None if it is unknown.
+        """
+        if isinstance(input_value, str):
+            return self._patterns.get(input_value)
+        elif isinstance(input_value, (list, tuple)) and len(input_value) == 2:
+            name, axis = input_value
+            if name in self._inversions and isinstance(axis, int) and 0 <= axis < 12:
+                return self._inversions[name][axis]
+        return None
+
+    @instrumented('pattern_lookup')
+    def mode(self, name, degree):
+        """
+        Return the mode of a pattern starting on its degree-th note (1 is the pattern itself), or None if it is unknown.
+        """
+        modes = self._modes.get(name)
+        if modes is None or not isinstance(degree, int) or not 1 <= degree <= len(modes):
+            return None
+        return self._patterns[name] if degree == 1 else modes[degree - 1]
+
+    def mask(self, input_value):
+        """
+        Return the 12-bit pitch-class mask for a name or a [name, axis] inversion, or None if it is unknown.
+        """
+        if isinstance(input_value, str):
+            return self._masks.get(input_value)
+        pattern = self.lookup(input_value)
+        return None if pattern is None else pattern_mask(pattern)
+
+    def names(self):
+        return list(self._patterns)
+
+    def items(self):
+        return self._patterns.items()
+
+    def __contains__(self, name):
+        return name in self._patterns
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __len__(self):
+        return len(self._patterns)
+
+
+# Define the chord patterns
+chord_registry = PatternRegistry({
+    # **Triadas Básicas**
+    'maj': [0, 4, 7],           # Mayor
+    'min': [0, 3, 7],           # Menor
+    'dim': [0, 3, 6],           # Disminuido
+    'aug': [0, 4, 8],           # Aumentado
+
+    # **Séptimas**
+    'maj7': [0, 4, 7, 11],      # Mayor 7
+    'min7': [0, 3, 7, 10],      # Menor 7
+    'dom7': [0, 4, 7, 10],      # Dominante 7
+    'dim7': [0, 3, 6, 9],       # Disminuido 7
+    'min7b5': [0, 3, 6, 10],    # Menor 7b5 (semi-disminuido)
+
+    # **Acordes Extendidos**
+    '9': [0, 4, 7, 10, 2],              # Dominante 9
+    'maj9': [0, 4, 7, 11, 2],           # Mayor 9
+    'min9': [0, 3, 7, 10, 2],           # Menor 9
+    '11': [0, 4, 7, 10, 2, 5],          # Dominante 11
+    '13': [0, 4, 7, 10, 2, 9],          # Dominante 13
+    'maj13': [0, 4, 7, 11, 2, 9],       # Mayor 13
+
+    # **Acordes con Notas Añadidas**
+    'add9': [0, 4, 7, 2],       # Añade la 9ª
+    'add11': [0, 4, 7, 5],      # Añade la 11ª
+    'add13': [0, 4, 7, 9],      # Añade la 13ª
+    'minadd9': [0, 3, 7, 2],
+
+    # **Acordes Suspendidos**
+    'sus2': [0, 2, 7],           # Suspendido 2
+    'sus4': [0, 5, 7],           # Suspendido 4
+    '7sus4': [0, 5, 7, 10],      # Dominante 7 Suspendido 4
+    '6sus4': [0, 5, 7, 9],       # Mayor 6 Suspendido 4
+
+    # **Acordes Alterados**
+    '7b5': [0, 4, 6, 10],        # Dominante 7b5
+    '7#5': [0, 4, 8, 10],        # Dominante 7#5
+    'maj7b5': [0, 4, 6, 11],     # Mayor 7b5
+    'maj7#5': [0, 4, 8, 11],     # Mayor 7#5
+    '9sus4': [0, 5, 7, 10, 2],   # Mayor 9 Suspendido 4
+    'maj9#11': [0, 4, 7, 11, 2, 6],  # Mayor 9#11
+
+    # **Acordes Menor Mayor Séptima**
+    'minmaj7': [0, 3, 7, 11],    # Menor Mayor 7
+
+    # **Acordes de Cuartal (Quartal Harmony)**
+    'quartal': [0, 5, 10],              # Cuartal Básico (root, perfect 4th, perfect 4th)
+    'quartal7': [0, 5, 10, 3],          # Cuartal con séptima menor
+    'quartal9': [0, 5, 10, 3, 7],       # Cuartal con séptima menor y quinta
+
+    # **Acordes de Quintal (Quintal Harmony)**
+    'quintal': [0, 7, 2],               # Quintal Básico (root, perfect 5th, major 2nd)
+    'quintal7': [0, 7, 2, 10],          # Quintal con séptima menor
+    'quintal9': [0, 7, 2, 10, 4],       # Quintal con séptima menor y tercera mayor
+
+    # **Acordes Power**
+    'power': [0, 7],                     # Power Chord (root y perfect 5th)
+    'power7': [0, 7, 10],                # Power Chord con séptima menor
+    'power9': [0, 7, 10, 2],             # Power Chord con séptima menor y 9ª
+
+    # **Acordes Adicionales**
+    'maj11': [0, 4, 7, 11, 5],           # Mayor 11
+    'maj7#11': [0, 4, 7, 11, 6],         # Mayor 7#11
+    'min11': [0, 3, 7, 10, 5],           # Menor 11
+    'min9b5': [0, 3, 6, 10, 2],          # Menor 9b5
+    'min11b5': [0, 3, 6, 10, 5, 2],      # Menor 11b5
+
+    # **Acordes Alterados Adicionales**
+    'aug7': [0, 4, 8, 10],               # Aumentado 7
+    'dim9': [0, 3, 6, 9, 2],             # Disminuido 9
+    'dim11': [0, 3, 6, 9, 5],            # Disminuido 11
+    'aug9': [0, 4, 8, 10, 2],            # Aumentado 9
+
+    # **Acordes Extendidos de Cuartal y Quintal**
+    'quartal11': [0, 5, 10, 3, 7],       # Cuartal 11
+    'quintal13': [0, 7, 2, 10, 4, 9],    # Quintal 13
+
+    # **Acordes Hexatónicos y Heptatónicos**
+    'hexatonic': [0, 4, 7, 11, 2, 9],    # Hexatónico
+    'heptatonic': [0, 2, 4, 5, 7, 9, 11],# Heptatónico
+
+    # **Otros Acordes Comunes**
+    'maj6': [0, 4, 7, 9],                # Mayor 6
+    'min6': [0, 3, 7, 9],                # Menor 6
+    'min6add9': [0, 3, 7, 9, 2],         # Menor 6 add9
+})
+
 # Function for chord patterns with intervals
 def chord_patterns(input_value):
     """
-    Fetches chord semitone patterns from a dictionary or returns the inverted semitones.
+    Fetches chord semitone patterns from the chord registry or returns the inverted semitones.
 
     Parameters:
     input_value (str or list): If a string, it's the name of the chord. If a list, it should contain [chord_name, axis].
@@ -135,140 +1103,79 @@ def chord_patterns(input_value):
     Returns:
     list or None: Returns a list of semitones for the chord or its inversion, or None if the chord name is not found.
     """
-    # Define the chord patterns dictionary
-    chord_dictionary = {
-        # **Triadas Básicas**
-        'maj': [0, 4, 7],           # Mayor
-        'min': [0, 3, 7],           # Menor
-        'dim': [0, 3, 6],           # Disminuido
-        'aug': [0, 4, 8],           # Aumentado
-
-        # **Séptimas**
-        'maj7': [0, 4, 7, 11],      # Mayor 7
-        'min7': [0, 3, 7, 10],      # Menor 7
-        'dom7': [0, 4, 7, 10],      # Dominante 7
-        'dim7': [0, 3, 6, 9],       # Disminuido 7
-        'min7b5': [0, 3, 6, 10],    # Menor 7b5 (semi-disminuido)
-
-        # **Acordes Extendidos**
-        '9': [0, 4, 7, 10, 2],              # Dominante 9
-        'maj9': [0, 4, 7, 11, 2],           # Mayor 9
-        'min9': [0, 3, 7, 10, 2],           # Menor 9
-        '11': [0, 4, 7, 10, 2, 5],          # Dominante 11
-        '13': [0, 4, 7, 10, 2, 9],          # Dominante 13
-        'maj13': [0, 4, 7, 11, 2, 9],       # Mayor 13
-
-        # **Acordes con Notas Añadidas**
-        'add9': [0, 4, 7, 2],       # Añade la 9ª
-        'add11': [0, 4, 7, 5],      # Añade la 11ª
-        'add13': [0, 4, 7, 9],      # Añade la 13ª
-        'minadd9': [0, 3, 7, 2],
-
-        # **Acordes Suspendidos**
-        'sus2': [0, 2, 7],           # Suspendido 2
-        'sus4': [0, 5, 7],           # Suspendido 4
-        '7sus4': [0, 5, 7, 10],      # Dominante 7 Suspendido 4
-        '6sus4': [0, 5, 7, 9],       # Mayor 6 Suspendido 4
-
-        # **Acordes Alterados**
-        '7b5': [0, 4, 6, 10],        # Dominante 7b5
-        '7#5': [0, 4, 8, 10],        # Dominante 7#5
-        'maj7b5': [0, 4, 6, 11],     # Mayor 7b5
-        'maj7#5': [0, 4, 8, 11],     # Mayor 7#5
-        '9sus4': [0, 5, 7, 10, 2],   # Mayor 9 Suspendido 4
-        'maj9#11': [0, 4, 7, 11, 2, 6],  # Mayor 9#11
-
-        # **Acordes Menor Mayor Séptima**
-        'minmaj7': [0, 3, 7, 11],    # Menor Mayor 7
-
-        # **Acordes de Cuartal (Quartal Harmony)**
-        'quartal': [0, 5, 10],              # Cuartal Básico (root, perfect 4th, perfect 4th)
-        'quartal7': [0, 5, 10, 3],          # Cuartal con séptima menor
-        'quartal9': [0, 5, 10, 3, 7],       # Cuartal con séptima menor y quinta
-
-        # **Acordes de Quintal (Quintal Harmony)**
-        'quintal': [0, 7, 2],               # Quintal Básico (root, perfect 5th, major 2nd)
-        'quintal7': [0, 7, 2, 10],          # Quintal con séptima menor
-        'quintal9': [0, 7, 2, 10, 4],       # Quintal con séptima menor y tercera mayor
-
-        # **Acordes Power**
-        'power': [0, 7],                     # Power Chord (root y perfect 5th)
-        'power7': [0, 7, 10],                # Power Chord con séptima menor
-        'power9': [0, 7, 10, 2],             # Power Chord con séptima menor y 9ª
-
-        # **Acordes Adicionales**
-        'maj11': [0, 4, 7, 11, 5],           # Mayor 11
-        'maj7#11': [0, 4, 7, 11, 6],         # Mayor 7#11
-        'min11': [0, 3, 7, 10, 5],           # Menor 11
-        'min9b5': [0, 3, 6, 10, 2],          # Menor 9b5
-        'min11b5': [0, 3, 6, 10, 5, 2],      # Menor 11b5
-
-        # **Acordes Alterados Adicionales**
-        'aug7': [0, 4, 8, 10],               # Aumentado 7
-        'dim9': [0, 3, 6, 9, 2],             # Disminuido 9
-        'dim11': [0, 3, 6, 9, 5],            # Disminuido 11
-        'aug9': [0, 4, 8, 10, 2],            # Aumentado 9
-
-        # **Acordes Extendidos de Cuartal y Quintal**
-        'quartal11': [0, 5, 10, 3, 7],       # Cuartal 11
-        'quintal13': [0, 7, 2, 10, 4, 9],    # Quintal 13
-
-        # **Acordes Hexatónicos y Heptatónicos**
-        'hexatonic': [0, 4, 7, 11, 2, 9],    # Hexatónico
-        'heptatonic': [0, 2, 4, 5, 7, 9, 11],# Heptatónico
-
-        # **Otros Acordes Comunes**
-        'maj6': [0, 4, 7, 9],                # Mayor 6
-        'min6': [0, 3, 7, 9],                # Menor 6
-        'min6add9': [0, 3, 7, 9, 2],               # 
-
-
-        # **Acordes con Alteraciones Específicas**
-        'maj7b5': [0, 4, 6, 11],             # Mayor 7b5
-        'maj7#5': [0, 4, 8, 11],             # Mayor 7#5
-
-        # **Acordes Diminuido y Aumentado con Extensiones**
-        'dim7': [0, 3, 6, 9],                 # Disminuido 7
-        'aug7': [0, 4, 8, 10],                # Aumentado 7
-    }
+    pattern = chord_registry.lookup(input_value)
+    return None if pattern is None else list(pattern)
 
-    
-    # Handle the input based on its type
-    if isinstance(input_value, str):
-        # Return the chord pattern if it exists
-        return chord_dictionary.get(input_value)
-    elif isinstance(input_value, list) and len(input_value) == 2:
-        chord_name, axis = input_value
-        # Check if the chord name exists and the axis is a valid integer
-        if chord_name in chord_dictionary and isinstance(axis, int) and 0 <= axis < 12:
-            # Perform the inversion
-            return [(2 * axis - note) % 12 for note in chord_dictionary[chord_name]]
-    # Return None if the input does not match expected formats or values
-    return None
+# Function to add a custom chord to the chord registry
+def register_chord(name, intervals):
+    chord_registry.register(name, intervals)
 
 # Example: Draw notes on the fretboard (e.g., a complex arpeggio)
-def draw_arpeggio(draw = init_fretboard(), root_note = 'C', arpeggio_type = 'maj'):
-    pattern = chord_patterns(arpeggio_type)
+def draw_arpeggio(draw = None, root_note = 'C', arpeggio_type = 'maj', instrument = None):
+    pattern = chord_registry.lookup(arpeggio_type)
     if not pattern:
         return
+    if draw is None:
+        draw = init_fretboard(instrument)
+    instrument = draw_instrument(draw, instrument)
     draw = fretboard_title(draw, f"{root_note} {arpeggio_type}")
-    root_note_index = chromatic_scale.index(root_note)
     colors = ['red', 'blue', 'green', 'purple', 'orange', 'yellow']  # Different colors for each interval
     
-    for string_index, string_notes in enumerate(fretboard):
-        for fret, note in enumerate(string_notes):
-            note_index = (chromatic_scale.index(note) - root_note_index) % 12
-            if any((note_index + 12 * octave) % 12 in pattern for octave in range(2)):
-                interval_index = next(i for i, interval in enumerate(pattern) if (interval % 12) == note_index)
-                color_index = interval_index % len(colors)
-                draw_note_on_fretboard(draw, fretboard, string_index, fret, colors[color_index], note)
+    for string_index, fret, pitch, interval_index in note_positions(root_note, pattern, instrument=instrument):
+        color_index = interval_index % len(colors)
+        draw_note_on_fretboard(draw, instrument, string_index, fret, colors[color_index], chromatic_scale[pitch])
 
     return draw
 
-# Dictionary for scale patterns with intervals
+# Define the scale patterns
+scale_registry = PatternRegistry({
+    'major': [0, 2, 4, 5, 7, 9, 11],
+    'minor': [0, 2, 3, 5, 7, 8, 10],
+    'harmonic_minor': [0, 2, 3, 5, 7, 8, 11],
+    'melodic_minor': [0, 2, 3, 5, 7, 9, 11],
+    'pentatonic_major': [0, 2, 4, 7, 9],
+    'pentatonic_minor': [0, 3, 5, 7, 10],
+    'blues': [0, 3, 5, 6, 7, 10],
+    'dorian': [0, 2, 3, 5, 7, 9, 10],
+    'phrygian': [0, 1, 3, 5, 7, 8, 10],
+    'lydian': [0, 2, 4, 6, 7, 9, 11],
+    'mixolydian': [0, 2, 4, 5, 7, 9, 10],
+    'locrian': [0, 1, 3, 5, 6, 8, 10],
+    'whole_tone': [0, 2, 4, 6, 8, 10],
+    'diminished': [0, 2, 3, 5, 6, 8, 9, 11],
+    'chromatic': [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+    'augmented': [0, 3, 4, 7, 8, 11],
+    'phrygian_dominant': [0, 1, 4, 5, 7, 8, 10],
+    'double_harmonic': [0, 1, 4, 5, 7, 8, 11],
+    'hungarian_minor': [0, 2, 3, 6, 7, 8, 11],
+    'neapolitan_minor': [0, 1, 3, 5, 7, 8, 11],
+    'neapolitan_major': [0, 1, 3, 5, 7, 9, 11],
+    'persian': [0, 1, 4, 5, 6, 8, 11],
+    'enigmatic': [0, 1, 4, 6, 8, 10, 11],
+    'hindu': [0, 2, 4, 5, 7, 8, 10],
+    'japanese': [0, 1, 5, 7, 8],
+    'arabic': [0, 2, 4, 5, 6, 8, 10],
+    'gypsy': [0, 2, 3, 6, 7, 8, 10],
+    'byzantine': [0, 1, 4, 5, 7, 8, 11],
+    'balinese': [0, 1, 3, 7, 8],
+    'todi': [0, 1, 3, 6, 7, 8, 11],
+    'bebop_major': [0, 2, 4, 5, 7, 9, 10, 11],
+    'bebop_minor': [0, 2, 3, 5, 7, 8, 9, 10],
+    'bebop_dominant': [0, 2, 4, 5, 7, 9, 10, 11],
+    'bebop_dorian': [0, 2, 3, 5, 7, 9, 10, 11],
+    'bebop_melodic_minor': [0, 2, 3, 5, 7, 8, 9, 11],
+    'bebop_harmonic_minor': [0, 2, 3, 5, 7, 8, 11, 12],
+    'flamenco': [0, 1, 3, 4, 5, 7, 8],
+    'romanian_minor': [0, 2, 3, 6, 7, 9, 10],
+    'javanese': [0, 1, 3, 5, 7, 8, 11],
+    'blues_major': [0, 2, 3, 4, 7, 9],
+    'blues_minor': [0, 3, 5, 6, 7, 10, 12],
+})
+
+# Function for scale patterns with intervals
 def scale_patterns(input_value):
     """
-    Fetches scale patterns from a dictionary or returns the inverted scales.
+    Fetches scale patterns from the scale registry or returns the inverted scales.
 
     Parameters:
     input_value (str or list): If a string, it's the name of the scale. If a list, it should contain [scale_name, axis].
@@ -276,71 +1183,160 @@ def scale_patterns(input_value):
     Returns:
     list or None: Returns a list of semitones for the scale or its inversion, or None if the scale name is not found.
     """
-    # Define the scale patterns dictionary
-    scale_dictionary = {
-        'major': [0, 2, 4, 5, 7, 9, 11],
-        'minor': [0, 2, 3, 5, 7, 8, 10],
-        'harmonic_minor': [0, 2, 3, 5, 7, 8, 11],
-        'melodic_minor': [0, 2, 3, 5, 7, 9, 11],
-        'pentatonic_major': [0, 2, 4, 7, 9],
-        'pentatonic_minor': [0, 3, 5, 7, 10],
-        'blues': [0, 3, 5, 6, 7, 10],
-        'dorian': [0, 2, 3, 5, 7, 9, 10],
-        'phrygian': [0, 1, 3, 5, 7, 8, 10],
-        'lydian': [0, 2, 4, 6, 7, 9, 11],
-        'mixolydian': [0, 2, 4, 5, 7, 9, 10],
-        'locrian': [0, 1, 3, 5, 6, 8, 10],
-        'whole_tone': [0, 2, 4, 6, 8, 10],
-        'diminished': [0, 2, 3, 5, 6, 8, 9, 11],
-        'chromatic': [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
-        'augmented': [0, 3, 4, 7, 8, 11],
-        'phrygian_dominant': [0, 1, 4, 5, 7, 8, 10],
-        'double_harmonic': [0, 1, 4, 5, 7, 8, 11],
-        'hungarian_minor': [0, 2, 3, 6, 7, 8, 11],
-        'neapolitan_minor': [0, 1, 3, 5, 7, 8, 11],
-        'neapolitan_major': [0, 1, 3, 5, 7, 9, 11],
-        'persian': [0, 1, 4, 5, 6, 8, 11],
-        'enigmatic': [0, 1, 4, 6, 8, 10, 11],
-        'hindu': [0, 2, 4, 5, 7, 8, 10],
-        'japanese': [0, 1, 5, 7, 8],
-        'arabic': [0, 2, 4, 5, 6, 8, 10],
-        'gypsy': [0, 2, 3, 6, 7, 8, 10],
-        'byzantine': [0, 1, 4, 5, 7, 8, 11],
-        'balinese': [0, 1, 3, 7, 8],
-        'todi': [0, 1, 3, 6, 7, 8, 11],
-        'bebop_major': [0, 2, 4, 5, 7, 9, 10, 11],
-        'bebop_minor': [0, 2, 3, 5, 7, 8, 9, 10],
-        'bebop_dominant': [0, 2, 4, 5, 7, 9, 10, 11],
-        'bebop_dorian': [0, 2, 3, 5, 7, 9, 10, 11],
-        'bebop_melodic_minor': [0, 2, 3, 5, 7, 8, 9, 11],
-        'bebop_harmonic_minor': [0, 2, 3, 5, 7, 8, 11, 12],
-        'flamenco': [0, 1, 3, 4, 5, 7, 8],
-        'romanian_minor': [0, 2, 3, 6, 7, 9, 10],
-        'javanese': [0, 1, 3, 5, 7, 8, 11],
-        'blues_major': [0, 2, 3, 4, 7, 9],
-        'blues_minor': [0, 3, 5, 6, 7, 10, 12]
-    }
-    
-    # Handle the input based on its type
-    if isinstance(input_value, str):
-        # Return the scale pattern if it exists
-        return scale_dictionary.get(input_value)
-    elif isinstance(input_value, list) and len(input_value) == 2:
-        scale_name, axis = input_value
-        # Check if the scale name exists and the axis is a valid integer
-        if scale_name in scale_dictionary and isinstance(axis, int) and 0 <= axis < 12:
-            # Perform the inversion
-            return [(2 * axis - note) % 12 for note in scale_dictionary[scale_name]]
-    # Return None if the input does not match expected formats or values
-    return None
+    pattern = scale_registry.lookup(input_value)
+    return None if pattern is None else list(pattern)
+
+# Function to add a custom scale to the scale registry
+def register_scale(name, intervals):
+    scale_registry.register(name, intervals)
+
+# Function to move a pitch-class mask relative to the root onto an absolute root
+def rotate_mask(mask, root_index):
+    root_index %= 12
+    return ((mask << root_index) | (mask >> (12 - root_index))) & 0xFFF
+
+# Function to get the pitch-class mask of a set of notes or fretted positions
+def notes_mask(notes=None, frets=None, instrument=None):
+    """
+    :param notes: Note names or pitch classes, e.g. ['C', 'E', 'G'].
+    :param frets: (string_index, fret) pairs, read from the instrument's fretboard.
+    :param instrument: Instrument the frets refer to (defaults to default_instrument).
+    :return: 12-bit mask of absolute pitch classes (bit 0 is C).
+    """
+    mask = 0
+    for note in notes or ():
+        mask |= 1 << ((note if isinstance(note, int) else note_to_index[note]) % 12)
+    if frets:
+        grid = get_instrument(instrument).grid
+        for string_index, fret in frets:
+            mask |= 1 << grid[string_index][fret]
+    return mask
+
+# One entry of the reverse index: a named chord or scale on a root (inversion is the axis, or None)
+PatternMatch = namedtuple('PatternMatch', ['kind', 'root', 'name', 'inversion'])
+
+# Reverse index from pitch-class sets to the chords and scales that spell them
+class PatternIndex:
+    """
+    Every registered pattern on every root, keyed by its absolute pitch-class mask.
+
+    The index is a flat 4096-entry table, so an exact lookup is one list access; subset and
+    superset queries walk the submasks of the query (or of its complement) instead of every
+    pattern. Inversions are kept in a second table and only searched on request.
+    """
+    def __init__(self, registries):
+        self.registries = registries
+        self.versions = {kind: registry.version for kind, registry in registries.items()}
+        self._tables = {False: [()] * 4096, True: [()] * 4096}
+        for kind, registry in registries.items():
+            for name in registry:
+                for root_index in range(12):
+                    root = chromatic_scale[root_index]
+                    self._add(False, rotate_mask(registry.mask(name), root_index), PatternMatch(kind, root, name, None))
+                    for axis in range(12):
+                        mask = rotate_mask(registry.mask([name, axis]), root_index)
+                        self._add(True, mask, PatternMatch(kind, root, name, axis))
+        # Masks that have any entry, without and with the inversions
+        self._used = {inversions: bytes(bool(self._tables[False][mask] or (inversions and self._tables[True][mask]))
+                                        for mask in range(4096))
+                      for inversions in (False, True)}
+
+    def _add(self, inversions, mask, match):
+        self._tables[inversions][mask] += (match,)
+
+    def is_current(self):
+        return all(registry.version == self.versions[kind] for kind, registry in self.registries.items())
+
+    def _matches(self, masks, kind, inversions):
+        tables = [self._tables[False], self._tables[True]] if inversions else [self._tables[False]]
+        return [match for mask in masks for table in tables for match in table[mask]
+                if kind is None or match.kind == kind]
+
+    def exact(self, mask, kind=None, inversions=False):
+        """
+        Return the patterns whose pitch classes are exactly the mask.
+        """
+        return self._matches([mask & 0xFFF], kind, inversions)
+
+    def supersets(self, mask, kind=None, inversions=False):
+        """
+        Return the patterns containing every pitch class of the mask, fewest extra notes first.
+        """
+        mask &= 0xFFF
+        complement = ~mask & 0xFFF
+        used = self._used[inversions]
+        masks = []
+        extra = complement
+        while True:
+            if used[mask | extra]:
+                masks.append(mask | extra)
+            if not extra:
+                break
+            extra = (extra - 1) & complement
+        masks.sort(key=_popcount)
+        return self._matches(masks, kind, inversions)
+
+    def subsets(self, mask, kind=None, inversions=False):
+        """
+        Return the patterns whose pitch classes all belong to the mask, largest first.
+        """
+        mask &= 0xFFF
+        used = self._used[inversions]
+        masks = []
+        part = mask
+        while part:
+            if used[part]:
+                masks.append(part)
+            part = (part - 1) & mask
+        masks.sort(key=_popcount, reverse=True)
+        return self._matches(masks, kind, inversions)
+
+_pattern_index = None
+_pattern_index_lock = threading.Lock()
+
+# Function to get the reverse index, rebuilding it when a chord or scale has been registered
+def get_pattern_index():
+    global _pattern_index
+    index = _pattern_index
+    if index is None or not index.is_current():
+        with _pattern_index_lock:
+            index = _pattern_index
+            if index is None or not index.is_current():
+                index = _pattern_index = PatternIndex({'chord': chord_registry, 'scale': scale_registry})
+    return index
+
+# Function to find the chords and scales that match a set of notes or frets
+def identify_patterns(notes=None, frets=None, match='exact', kind=None, inversions=False, instrument=None):
+    """
+    Find the chords and scales, on every root, that match a set of notes.
+
+    Parameters:
+    notes (list): Note names or pitch classes.
+    frets (list): (string_index, fret) pairs on the instrument, combined with notes.
+    match (str): 'exact' (same pitch classes), 'superset' (patterns containing all the notes,
+    e.g. scales compatible with an arpeggio) or 'subset' (patterns made only of these notes,
+    e.g. chords inside a scale).
+    kind (str): 'chord' or 'scale' to search only one registry, or None for both.
+    inversions (bool): Also match the [name, axis] inversions.
+    instrument (Instrument): Instrument the frets refer to.
+
+    Returns:
+    list: PatternMatch(kind, root, name, inversion) entries.
+    """
+    queries = {'exact': PatternIndex.exact, 'superset': PatternIndex.supersets, 'subset': PatternIndex.subsets}
+    if match not in queries:
+        raise ValueError(f"Unknown match '{match}'.")
+    return queries[match](get_pattern_index(), notes_mask(notes, frets, instrument), kind, inversions)
 
 # Function to draw scales on the fretboard
-def draw_black_scale(draw = init_fretboard(), root_note = 'C', scale_type = 'major'):
-    pattern = scale_patterns(scale_type)
+def draw_black_scale(draw = None, root_note = 'C', scale_type = 'major', instrument = None, mode = None):
+    pattern = scale_registry.lookup(scale_type) if mode is None else scale_registry.mode(scale_type, mode)
     if not pattern:
         return
+    if draw is None:
+        draw = init_fretboard(instrument)
+    instrument = draw_instrument(draw, instrument)
     #draw = fretboard_title(draw, f"{root_note} {scale_type}")
-    root_note_index = chromatic_scale.index(root_note)
 
     # Define specific colors for the intervals
     interval_colors = {
@@ -354,28 +1350,25 @@ def draw_black_scale(draw = init_fretboard(), root_note = 'C', scale_type = 'maj
     }
     default_color = 'black'  # Default color for other intervals
     
-    for string_index, string_notes in enumerate(fretboard):
-        for fret, note in enumerate(string_notes):
-            note_index = (chromatic_scale.index(note) - root_note_index) % 12
-            if any((note_index + 12 * octave) % 12 in pattern for octave in range(2)):
-                interval_index = next(i for i, interval in enumerate(pattern) if (interval % 12) == note_index)
-                
-                # Check if the interval is in the highlighted intervals and select the corresponding color
-                if interval_index in [0, 2, 4, 6]:  # Root (0), Third (4), Fifth (7), Seventh (11) intervals
-                    color = interval_colors.get(pattern[interval_index], default_color)
-                else:
-                    color = default_color
-                
-                draw_note_on_fretboard(draw, fretboard, string_index, fret, color, note, text='white')
+    for string_index, fret, pitch, interval_index in note_positions(root_note, pattern, instrument=instrument):
+        # Check if the interval is in the highlighted intervals and select the corresponding color
+        if interval_index in [0, 2, 4, 6]:  # Root (0), Third (4), Fifth (7), Seventh (11) intervals
+            color = interval_colors.get(pattern[interval_index], default_color)
+        else:
+            color = default_color
+        
+        draw_note_on_fretboard(draw, instrument, string_index, fret, color, chromatic_scale[pitch], text='white')
     return draw
 
 # Function to draw scales on the fretboard
-def draw_scale(draw = init_fretboard(), root_note = 'C', scale_type = 'major'):
-    pattern = scale_patterns(scale_type)
+def draw_scale(draw = None, root_note = 'C', scale_type = 'major', instrument = None, mode = None):
+    pattern = scale_registry.lookup(scale_type) if mode is None else scale_registry.mode(scale_type, mode)
     if not pattern:
         return
-    draw = fretboard_title(draw, f"{root_note} {scale_type}")
-    root_note_index = chromatic_scale.index(root_note)
+    if draw is None:
+        draw = init_fretboard(instrument)
+    instrument = draw_instrument(draw, instrument)
+    draw = fretboard_title(draw, f"{root_note} {scale_type}" + (f" mode {mode}" if mode not in (None, 1) else ''))
 
     # Define specific colors for the intervals
     interval_colors = {
@@ -389,65 +1382,227 @@ def draw_scale(draw = init_fretboard(), root_note = 'C', scale_type = 'major'):
     }
     default_color = 'lightblue'  # Default color for other intervals
     
-    for string_index, string_notes in enumerate(fretboard):
-        for fret, note in enumerate(string_notes):
-            note_index = (chromatic_scale.index(note) - root_note_index) % 12
-            if any((note_index + 12 * octave) % 12 in pattern for octave in range(2)):
-                interval_index = next(i for i, interval in enumerate(pattern) if (interval % 12) == note_index)
-                
-                # Check if the interval is in the highlighted intervals and select the corresponding color
-                if interval_index in [0, 2, 4, 6]:  # Root (0), Third (4), Fifth (7), Seventh (11) intervals
-                    color = interval_colors.get(pattern[interval_index], default_color)
-                else:
-                    color = default_color
-                
-                draw_note_on_fretboard(draw, fretboard, string_index, fret, color, note)
+    for string_index, fret, pitch, interval_index in note_positions(root_note, pattern, instrument=instrument):
+        # Check if the interval is in the highlighted intervals and select the corresponding color
+        if interval_index in [0, 2, 4, 6]:  # Root (0), Third (4), Fifth (7), Seventh (11) intervals
+            color = interval_colors.get(pattern[interval_index], default_color)
+        else:
+            color = default_color
+        
+        draw_note_on_fretboard(draw, instrument, string_index, fret, color, chromatic_scale[pitch])
     return draw
 
+# Colours the zones of draw_arpeggios_zones cycle through
+zone_colors = ['red', 'blue', 'green', 'purple', 'orange', 'yellow', 'pink', 'cyan', 'magenta']
+
 # Function to draw arpeggios in specified zones on the fretboard
-def draw_arpeggios_zones(draw = init_fretboard(), zones = [['C', 'min', 5, 12, 1, 7]]):
+def draw_arpeggios_zones(draw = None, zones = None, instrument = None, colors = None, seed = None):
+    """
+    Draw the chord tones of each zone, one colour per zone.
+
+    Colours are deterministic: zones cycle through colors (default zone_colors), or, with
+    a seed, get random colours from a generator seeded with it, so the same zones always
+    give the same image.
+    """
+    if draw is None:
+        draw = init_fretboard(instrument)
+    instrument = draw_instrument(draw, instrument)
+    if zones is None:
+        zones = [['C', 'min', 5, 12, 1, 7]]
     # List of colors to cycle through
-    color_cycle = ['red', 'blue', 'green', 'purple', 'orange', 'yellow', 'pink', 'cyan', 'magenta']
+    color_cycle = [tuple(color) if isinstance(color, list) else color for color in colors or zone_colors]
     color_index = 0
     title = ""
     for zone in zones:
         title += f" {zone[0]}{zone[1]} " 
     draw = fretboard_title(draw, f"{title}")
-    # Function to generate a random color
+    # Function to generate a random color (reproducible for a given seed)
+    rng = random.Random(seed)
     def get_random_color():
-        return (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+        return (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
 
     # Iterate through each specified zone
     for zone in zones:
         note, chord_type, start_fret, end_fret, start_string, end_string = zone
 
         # Get the pattern for the chord and the root note index
-        pattern = chord_patterns(chord_type)
+        pattern = chord_registry.lookup(chord_type)
         # Validate if chord type exists in the dictionary
         if not pattern:
             continue
 
-        root_note_index = chromatic_scale.index(note)
         
-        # Choose a color strategy: uncomment one of the following lines
-        # color = color_cycle[color_index % len(color_cycle)]  # Cycle through predefined colors
-        color = get_random_color()  # Generate a random color
+        # Choose a color strategy: random colours from the seed, or cycle through the predefined colors
+        if seed is not None:
+            color = get_random_color()
+        else:
+            color = color_cycle[color_index % len(color_cycle)]
         
         # Update the color index for the next zone
         color_index += 1
         
-        # Iterate over the string and fret range specified in the zone
-        for string_index in range(start_string - 1, end_string):
-            string_notes = fretboard[string_index]
-            for fret in range(start_fret, end_fret + 1):
-                note_at_fret = string_notes[fret]
-                note_index = (chromatic_scale.index(note_at_fret) - root_note_index) % 12
-                # Check if the note at the fret is part of the chord pattern
-                if any((note_index + 12 * octave) % 12 in pattern for octave in range(2)):
-                    draw_note_on_fretboard(draw, fretboard, string_index, fret, color, note_at_fret)
+        # Iterate over the chord notes in the string and fret range specified in the zone
+        zone_positions = note_positions(note, pattern, range(start_string - 1, end_string), range(start_fret, end_fret + 1), instrument)
+        for string_index, fret, pitch, interval_index in zone_positions:
+            draw_note_on_fretboard(draw, instrument, string_index, fret, color, chromatic_scale[pitch])
     return draw
 
 
+# A playable chord shape: one fret (or None for a muted string) per string, lowest string first
+class Voicing(namedtuple('Voicing', ['root', 'chord', 'frets', 'pitches', 'stretch', 'position'])):
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        """
+        Return the usual chord-chart spelling, e.g. 'x32010' (frets above 9 are separated by dashes).
+        """
+        marks = ['x' if fret is None else str(fret) for fret in self.frets]
+        return ('-' if any(len(mark) > 1 for mark in marks) else '').join(marks)
+
+    @property
+    def bass(self):
+        return next((pitch for pitch in self.pitches if pitch is not None), None)
+
+# Function to list the chord tones a string can play inside a fret range (memoized per string)
+@lru_cache(maxsize=1024)
+def _string_candidates(string_pitches, positions, start, stop):
+    """
+    Return (open_pitch, frets, pitches) for one string: the open string pitch if it is a
+    chord tone (else None), then the fretted chord tones sorted by fret for bisect lookups.
+    """
+    open_pitch = string_pitches[0] if start == 0 and positions[string_pitches[0]] is not None else None
+    fretted = [(fret, string_pitches[fret]) for fret in range(max(start, 1), stop)
+               if positions[string_pitches[fret]] is not None]
+    return open_pitch, tuple(fret for fret, _ in fretted), tuple(pitch for _, pitch in fretted)
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+# Function to enumerate the playable voicings of a chord
+def find_voicings(root_note, chord_type, max_stretch=3, bass=None, required=None, min_strings=None,
+                  frets=None, instrument=None):
+    """
+    Generate every voicing of a chord with one fret (or a muted string) per string.
+
+    The search walks the strings from the lowest one and drops a branch as soon as it
+    breaks the stretch limit, the bass note, or can no longer cover the required tones
+    with the strings left. Per-string candidate frets are memoized, so repeated searches
+    over the same chord tones only pay for the walk itself.
+
+    Parameters:
+    root_note (str or int): Root note name or pitch class.
+    chord_type (str or list): Chord name or [chord_name, axis], as accepted by chord_patterns().
+    max_stretch (int): Largest distance between the lowest and highest fretted notes (open strings are free).
+    bass (str or int): Note that must be played on the lowest sounding string, or None for any chord tone.
+    required (list): Semitones from the root that must sound (defaults to every chord tone).
+    min_strings (int): Minimum number of sounding strings (defaults to the number of required tones).
+    frets (range): Frets to search (clipped to the fretboard; defaults to the whole neck).
+    instrument (Instrument): Instrument to search (defaults to default_instrument).
+
+    Yields:
+    Voicing: In search order (lowest string first, muted before open before fretted, lower frets first).
+    Use rank_voicings() to order them.
+    """
+    pattern = chord_registry.lookup(chord_type)
+    if pattern is None:
+        raise KeyError(f"Unknown chord '{chord_type}'.")
+    instrument = get_instrument(instrument)
+    root_index = (root_note if isinstance(root_note, int) else note_to_index[root_note]) % 12
+    positions = interval_table(root_index, pattern)
+    if required is None:
+        required = pattern
+    elif any(positions[(root_index + interval) % 12] is None for interval in required):
+        raise ValueError(f"Required intervals {list(required)} are not all part of {chord_type}.")
+    required_mask = pattern_mask([root_index + interval for interval in required])
+    if min_strings is None:
+        min_strings = _popcount(required_mask)
+    bass_pitch = None if bass is None else (bass if isinstance(bass, int) else note_to_index[bass]) % 12
+    if bass_pitch is not None and positions[bass_pitch] is None:
+        raise ValueError(f"Bass note {bass} is not part of {root_note} {chord_type}.")
+    fret_range = _clip_range(frets, instrument.num_positions)
+    candidates = [_string_candidates(string_pitches, positions, fret_range.start, fret_range.stop)
+                  for string_pitches in instrument.grid]
+    num_strings = len(candidates)
+    chosen_frets = [None] * num_strings
+    chosen_pitches = [None] * num_strings
+
+    def search(string_index, low, high, covered, sounding):
+        if string_index == num_strings:
+            if sounding >= min_strings and covered & required_mask == required_mask:
+                position = low if low is not None else 0
+                yield Voicing(root_note, chord_type, tuple(chosen_frets), tuple(chosen_pitches),
+                              0 if low is None else high - low, position)
+            return
+        remaining = num_strings - string_index - 1
+        # Muted string
+        if sounding + remaining >= min_strings and _popcount(required_mask & ~covered) <= remaining:
+            chosen_frets[string_index] = chosen_pitches[string_index] = None
+            yield from search(string_index + 1, low, high, covered, sounding)
+        open_pitch, string_frets, string_pitches = candidates[string_index]
+        check_bass = bass_pitch is not None and sounding == 0
+        # Open string
+        if open_pitch is not None and not (check_bass and open_pitch != bass_pitch):
+            new_covered = covered | 1 << open_pitch
+            if _popcount(required_mask & ~new_covered) <= remaining:
+                chosen_frets[string_index], chosen_pitches[string_index] = 0, open_pitch
+                yield from search(string_index + 1, low, high, new_covered, sounding + 1)
+        # Fretted notes, limited to the window the stretch still allows
+        if low is None:
+            first, last = 0, len(string_frets)
+        else:
+            first = bisect_left(string_frets, high - max_stretch)
+            last = bisect_right(string_frets, low + max_stretch)
+        for index in range(first, last):
+            fret, pitch = string_frets[index], string_pitches[index]
+            if check_bass and pitch != bass_pitch:
+                continue
+            new_covered = covered | 1 << pitch
+            if _popcount(required_mask & ~new_covered) > remaining:
+                continue
+            chosen_frets[string_index], chosen_pitches[string_index] = fret, pitch
+            yield from search(string_index + 1, fret if low is None else min(low, fret),
+                              fret if high is None else max(high, fret), new_covered, sounding + 1)
+        chosen_frets[string_index] = chosen_pitches[string_index] = None
+
+    return search(0, None, None, 0, 0)
+
+# Sort keys for rank_voicings()
+voicing_rankings = {
+    'stretch': lambda voicing: (voicing.stretch, voicing.position, voicing.frets.count(None)),
+    'position': lambda voicing: (voicing.position, voicing.stretch, voicing.frets.count(None)),
+}
+
+# Function to order voicings by stretch or by position on the neck
+def rank_voicings(voicings, by='stretch', limit=None):
+    """
+    Order voicings, easiest first.
+
+    :param voicings: Iterable of Voicing, e.g. from find_voicings().
+    :param by: 'stretch' (smallest hand span, then lowest position) or 'position' (lowest on the neck, then span).
+    :param limit: Keep only the best voicings; the input is streamed through a heap instead of sorted whole.
+    :return: List of Voicing.
+    """
+    key = voicing_rankings[by]
+    if limit is None:
+        return sorted(voicings, key=key)
+    return heapq.nsmallest(limit, voicings, key=key)
+
+# Function to draw a single voicing on the fretboard
+def draw_voicing(draw = None, voicing = None, instrument = None):
+    if draw is None:
+        draw = init_fretboard(instrument)
+    instrument = draw_instrument(draw, instrument)
+    draw = fretboard_title(draw, f"{voicing.root} {voicing.chord} {voicing.shape}")
+    colors = ['red', 'blue', 'green', 'purple', 'orange', 'yellow']  # Same colours as draw_arpeggio
+    positions = interval_table(voicing.root, chord_registry.lookup(voicing.chord))
+    for string_index, (fret, pitch) in enumerate(zip(voicing.frets, voicing.pitches)):
+        if fret is not None:
+            draw_note_on_fretboard(draw, instrument, string_index, fret, colors[positions[pitch] % len(colors)], chromatic_scale[pitch])
+    return draw
+
+
+@instrumented('merge')
 def merge_images_vertically(images):
     """
     Merge a list of images vertically (top to bottom).
@@ -473,18 +1628,22 @@ def merge_images_vertically(images):
     
     return merged_image
 
-def merge_images_grid(images):
+@instrumented('merge')
+def merge_images_grid(images, columns=2):
     """
-    Merge a list of images into a grid with 2 images per row.
+    Merge a list of images into a grid with a fixed number of images per row.
     
     :param images: List of Pillow Image objects to be merged.
+    :param columns: Number of images per row.
     :return: A new Pillow Image object with images arranged in a grid.
     """
     if not images:
         raise ValueError("The image list cannot be empty.")
+    if columns < 1:
+        raise ValueError("The number of columns must be at least 1.")
     
-    # Group images into rows of 2 images each
-    rows = [images[i:i+2] for i in range(0, len(images), 2)]
+    # Group images into rows of `columns` images each
+    rows = [images[i:i+columns] for i in range(0, len(images), columns)]
     
     # Calculate the total width and height
     total_width = 0
@@ -514,103 +1673,1563 @@ def merge_images_grid(images):
     return merged_image
 
 
-# Example usage of draw_arpeggios_zones
-# [Note, chord, fret start, fret end, string start, string end]
-zones = [
-    # Diminished to Minor Resolution
-    ['C#', 'min', 9, 12, 1, 7], # C#m: Fret 9-12, Strings 1-6
-    ['C', 'dim', 8, 9, 1, 7],   # Cdim: Fret 8-9, Strings 1-6
-    ['B', 'min', 7, 9, 1, 7],   # Bm: Fret 7-9, Strings 1-6
-    ['E', 'aug', 1, 5, 1, 7], # Eaug: Fret 12-15, Strings 1-6
-    ['A', 'maj', 5, 8, 1, 7],   # Amaj: Fret 5-8, Strings 1-6
-]
+# Minimal streaming PNG encoder: image strips are compressed and written as they arrive
+class PNGStripWriter:
+    """
+    Write a PNG one horizontal strip at a time, so the full image never has to be in memory.
 
+    The height does not need to be known up front: on a seekable file the header is patched
+    when the writer is closed, otherwise the (compressed) data is kept until close().
+    Leaving a with block on an exception calls abort() instead, so a failed composition never
+    leaves a valid-looking truncated PNG behind.
+    """
+    _color_types = {'L': 0, 'RGB': 2, 'RGBA': 6}
+    chunk_rows = 64  # Rows converted to raw bytes at a time
+
+    def __init__(self, fp, width, mode='RGB', height=None, compress_level=6, dpi=None):
+        if mode not in self._color_types:
+            raise ValueError(f"Unsupported PNG strip mode '{mode}'.")
+        self._own_file = isinstance(fp, (str, os.PathLike))
+        self._path = fp if self._own_file else None
+        self.fp = open(fp, 'wb') if self._own_file else fp
+        self.width = width
+        self.mode = mode
+        self.height = 0
+        self._expected_height = height
+        self._stride = width * len(mode)
+        self.dpi = dpi
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = None
+        try:
+            self._header_offset = self.fp.tell() if height is None and self.fp.seekable() else None
+        except (AttributeError, OSError):
+            self._header_offset = None
+        if height is None and self._header_offset is None:
+            # Unknown height on a stream we cannot seek back in: hold the compressed chunks until close()
+            self._pending = []
+        else:
+            self._write_header(height or 0)
+
+    def _chunk(self, chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    def _write_header(self, height):
+        ihdr = struct.pack('>IIBBBBB', self.width, height, 8, self._color_types[self.mode], 0, 0, 0)
+        header = b'\x89PNG\r\n\x1a\n' + self._chunk(b'IHDR', ihdr)
+        if self.dpi:
+            # Pixels per metre, unit 1 (metre)
+            ppm = int(round(self.dpi / 0.0254))
+            header += self._chunk(b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+        self.fp.write(header)
+
+    def _write_data(self, data):
+        if not data:
+            return
+        if self._pending is not None:
+            self._pending.append(data)
+        else:
+            self.fp.write(self._chunk(b'IDAT', data))
+
+    @instrumented('encode')
+    def write(self, strip):
+        """
+        Append a strip (a Pillow image as wide as the PNG) below the rows written so far.
+        """
+        if strip.width != self.width:
+            raise ValueError(f"Strip width {strip.width} does not match the PNG width {self.width}.")
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        stride = self._stride
+        # Encode a few rows at a time so a tall strip is never copied whole
+        for top in range(0, strip.height, self.chunk_rows):
+            raw = strip.crop((0, top, self.width, min(top + self.chunk_rows, strip.height))).tobytes()
+            # Every scanline starts with filter type 0 (None)
+            rows = b''.join(b'\x00' + raw[i:i + stride] for i in range(0, len(raw), stride))
+            self._write_data(self._compressor.compress(rows))
+        self.height += strip.height
+
+    def close(self):
+        if self._compressor is None:
+            return
+        if self._expected_height is not None and self._expected_height != self.height:
+            raise ValueError(f"Wrote {self.height} rows but the PNG header says {self._expected_height}.")
+        tail = self._compressor.flush()
+        self._compressor = None
+        if self._pending is not None:
+            self._write_header(self.height)
+            self.fp.write(self._chunk(b'IDAT', b''.join(self._pending + [tail])))
+            self._pending = None
+        else:
+            self._write_data(tail)
+        self.fp.write(self._chunk(b'IEND', b''))
+        if self._expected_height is None and self._header_offset is not None:
+            end = self.fp.tell()
+            self.fp.seek(self._header_offset)
+            self._write_header(self.height)
+            self.fp.seek(end)
+        if self._own_file:
+            self.fp.close()
+
+    def abort(self):
+        """
+        Stop without finishing the PNG: a file the writer opened itself is removed, a file
+        object passed in is left as it is (without IEND, so decoders reject it).
+        """
+        if self._compressor is None:
+            return
+        self._compressor = None
+        self._pending = None
+        if self._own_file:
+            self.fp.close()
+            os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
 
 
-#############################################################
-#### EXAMPLES ######
-#############################################################
+# Function to get the Pillow image out of a draw object (or pass an image through)
+def _as_image(diagram):
+    return diagram.image if isinstance(diagram, ImageDraw.ImageDraw) else diagram
 
-# Call the function to draw arpeggios in the specified zones
-# draw_arpeggios_zones(init_fretboard(), zones).show()
+# Function to compose a grid from a stream of diagrams without keeping them all in memory
+@instrumented('merge')
+def compose_grid(diagrams, columns=2, count=None, output=None, compress_level=6, dpi=None):
+    """
+    Compose diagrams into a grid as they arrive.
+
+    Every diagram must have the size of the first one (ValueError otherwise; merge_images_grid
+    lays out diagrams of mixed sizes). With output=None the diagrams are pasted
+    into one preallocated canvas, which needs to know how many diagrams there are (count,
+    or len(diagrams)). With an output path or binary file each finished row is encoded
+    straight into a PNG, so only one row strip is ever held in memory.
+
+    :param diagrams: Iterable (e.g. a generator) of Pillow images or draw objects.
+    :param columns: Number of diagrams per row.
+    :param count: Number of diagrams, needed for the in-memory canvas if diagrams has no len().
+    :param output: Path or binary file to stream a PNG to.
+    :param compress_level: zlib level for the streamed PNG.
+    :param dpi: Resolution recorded in the streamed PNG (pHYs chunk).
+    :return: The composed Pillow image, or output when streaming to a file.
+    """
+    if columns < 1:
+        raise ValueError("The number of columns must be at least 1.")
+    if output is None and count is None:
+        try:
+            count = len(diagrams)
+        except TypeError:
+            raise ValueError("compose_grid needs count (or an output file) for a generator of diagrams.")
+    diagrams = iter(diagrams)
+
+    first = next(diagrams, None)
+    if first is None:
+        raise ValueError("The image list cannot be empty.")
+    first = _as_image(first)
+    cell_width, cell_height = first.size
+    row_width = cell_width * columns
+
+    def cells():
+        # Hand the first diagram over so it is not kept alive for the whole grid
+        nonlocal first
+        image, first = first, None
+        yield image
+        for diagram in diagrams:
+            image = _as_image(diagram)
+            if image.size != (cell_width, cell_height):
+                raise ValueError(f"All diagrams must have the size of the first one, {cell_width}x{cell_height} "
+                                 f"(got {image.width}x{image.height}); use merge_images_grid for mixed sizes.")
+            yield image
+
+    if output is None:
+        rows = -(-count // columns)
+        canvas = Image.new('RGB', (row_width, rows * cell_height))
+        for index, image in enumerate(cells()):
+            if index >= count:
+                raise ValueError(f"More diagrams than count ({count}).")
+            canvas.paste(image, ((index % columns) * cell_width, (index // columns) * cell_height))
+        return canvas
+
+    with PNGStripWriter(output, row_width, compress_level=compress_level, dpi=dpi) as writer:
+        strip = None
+        for index, image in enumerate(cells()):
+            if columns == 1 and image.size == (row_width, cell_height) and image.mode == 'RGB':
+                # A single column needs no strip: each diagram is a full row
+                writer.write(image)
+                continue
+            if index % columns == 0:
+                if strip is not None:
+                    writer.write(strip)
+                strip = Image.new('RGB', (row_width, cell_height))
+            strip.paste(image, ((index % columns) * cell_width, 0))
+        if strip is not None:
+            writer.write(strip)
+    return output
+
+
+# Layer types a diagram spec can stack, mapped to the function that draws them
+layer_renderers = {
+    'scale': lambda draw, layer: draw_scale(draw, layer['root'], layer['pattern'], mode=layer.get('mode')),
+    'black_scale': lambda draw, layer: draw_black_scale(draw, layer['root'], layer['pattern'], mode=layer.get('mode')),
+    'arpeggio': lambda draw, layer: draw_arpeggio(draw, layer['root'], layer['pattern']),
+    'zones': lambda draw, layer: draw_arpeggios_zones(draw, layer['zones'], colors=layer.get('colors'), seed=layer.get('seed')),
+}
+
+# Function to check one zone, [root, chord, start fret, end fret, start string, end string]
+def normalize_zone(zone):
+    if not isinstance(zone, (list, tuple)) or len(zone) != 6:
+        raise ValueError(f"A zone must be [root, chord, start fret, end fret, start string, end string]: {zone!r}")
+    root, chord, start_fret, end_fret, start_string, end_string = zone
+    if root not in note_to_index:
+        raise ValueError(f"Unknown root note '{root}' in zone {zone!r}.")
+    chord = list(chord) if isinstance(chord, (list, tuple)) else chord
+    if chord_registry.lookup(chord) is None:
+        raise ValueError(f"Unknown chord '{chord}' in zone {zone!r}.")
+    if not all(isinstance(value, int) for value in zone[2:]):
+        raise ValueError(f"The frets and strings of a zone must be integers: {zone!r}")
+    if not 0 <= start_fret <= end_fret or not 1 <= start_string <= end_string:
+        raise ValueError(f"A zone needs 0 <= start fret <= end fret and 1 <= start string <= end string: {zone!r}")
+    return [root, chord, start_fret, end_fret, start_string, end_string]
+
+# Function to turn a layer dict into {'type', 'root', 'pattern'} (plus 'mode' for a mode of a scale, or {'type', 'zones'})
+def normalize_layer(layer, default_type=None):
+    if 'zones' in layer:
+        normalized = {'type': 'zones', 'zones': [normalize_zone(zone) for zone in layer['zones']]}
+        if layer.get('colors'):
+            normalized['colors'] = [list(color) if isinstance(color, (list, tuple)) else color for color in layer['colors']]
+            for color in normalized['colors']:
+                if isinstance(color, list):
+                    if len(color) not in (3, 4) or not all(isinstance(channel, int) and 0 <= channel <= 255 for channel in color):
+                        raise ValueError(f"A zone colour must be a name or 3-4 channels from 0 to 255: {color!r}")
+                else:
+                    ImageColor.getrgb(color)  # ValueError for an unknown colour name
+        if layer.get('seed') is not None:
+            normalized['seed'] = int(layer['seed'])
+        return normalized
+
+    if 'chord' in layer:
+        layer_type, name, registry = layer.get('type', 'arpeggio'), layer['chord'], chord_registry
+    elif 'scale' in layer:
+        layer_type, name, registry = layer.get('type', default_type or 'scale'), layer['scale'], scale_registry
+    elif 'pattern' in layer and 'type' in layer:
+        layer_type, name = layer['type'], layer['pattern']
+        registry = chord_registry if layer_type == 'arpeggio' else scale_registry
+    else:
+        raise ValueError(f"Layer needs a 'scale', 'chord' or 'zones' entry: {layer!r}")
+
+    if layer_type not in layer_renderers:
+        raise ValueError(f"Unknown layer type '{layer_type}'.")
+    root = layer.get('root', 'C')
+    if root not in note_to_index:
+        raise ValueError(f"Unknown root note '{root}'.")
+    # Inversions can be given as [name, axis] or with a separate 'axis' entry
+    pattern = list(name) if isinstance(name, (list, tuple)) else name
+    if layer.get('axis') is not None:
+        pattern = [name, layer['axis']]
+    if registry.lookup(pattern) is None:
+        kind = 'chord' if registry is chord_registry else 'scale'
+        raise ValueError(f"Unknown {kind} '{name}'.")
+    normalized = {'type': layer_type, 'root': root, 'pattern': pattern}
+    # A mode is given by the degree of the scale it starts on, 1 being the scale itself
+    if layer.get('mode') not in (None, 1):
+        if registry is not scale_registry or not isinstance(pattern, str):
+            raise ValueError(f"Only a named scale can have a mode: {layer!r}")
+        if scale_registry.mode(pattern, layer['mode']) is None:
+            raise ValueError(f"Scale '{name}' has no mode {layer['mode']!r}.")
+        normalized['mode'] = layer['mode']
+    return normalized
+
+# Function to get the semitones a normalized layer draws (a list of them for a zones layer)
+def layer_intervals(layer):
+    if layer['type'] == 'zones':
+        return [chord_registry.lookup(zone[1]) for zone in layer['zones']]
+    if layer['type'] == 'arpeggio':
+        return chord_registry.lookup(layer['pattern'])
+    if layer.get('mode') is not None:
+        return scale_registry.mode(layer['pattern'], layer['mode'])
+    return scale_registry.lookup(layer['pattern'])
+
+# Function to normalize a diagram spec into a plain list of layers
+def normalize_spec(spec):
+    """
+    Normalize a plain-data diagram spec.
+
+    A spec is a dict with either a 'layers' list or a single base layer given by
+    'root' plus 'scale' or 'chord' (and optionally 'axis' for an inversion, or 'mode'
+    for the mode of a scale starting on that degree, e.g. 'major' mode 2 on D is D dorian).
+    Extra layers go in 'overlays'; when there are overlays a base scale is drawn in black,
+    like the harmonized-scale examples. Each layer is a dict with 'root' and 'scale'
+    or 'chord' (optionally 'type', 'axis' and 'mode'), or a 'zones' list. An optional
+    'instrument' entry is a preset name from instruments or a dict of Instrument settings,
+    and 'pixel_scale' renders the diagram at a higher resolution (see Instrument).
+
+    :param spec: Diagram spec.
+    :return: {'layers': [...]} (plus 'instrument' if given) with every layer in the form used by render_spec.
+    """
+    overlays = list(spec.get('overlays', []))
+    if 'layers' in spec:
+        layers = [normalize_layer(layer) for layer in spec['layers']]
+    else:
+        base_type = 'black_scale' if overlays and 'type' not in spec else None
+        layers = [normalize_layer(spec, default_type=base_type)]
+    layers += [normalize_layer(layer) for layer in overlays]
+    normalized = {'layers': layers}
+    if spec.get('instrument') is not None:
+        get_instrument(spec['instrument'])  # Validate it
+        normalized['instrument'] = spec['instrument']
+    if spec.get('pixel_scale') not in (None, 1):
+        normalized['pixel_scale'] = float(spec['pixel_scale'])
+    spec_instrument(normalized)  # Validate the size of the diagram (see max_image_pixels)
+    return normalized
+
+# Function to get the instrument of a normalized spec, at its pixel scale
+def spec_instrument(spec):
+    return get_instrument(spec.get('instrument')).scaled(spec.get('pixel_scale', 1))
+
+# Function to render a diagram spec into a new fretboard
+def render_spec(spec, backend='raster', canvas=None):
+    """
+    Render a diagram spec (see normalize_spec) onto a fresh fretboard.
 
-# Draw a scale, for example, a 'C# major' scale
-# draw_scale(draw, 'C#', 'major').show()
+    :param spec: Diagram spec.
+    :param backend: 'raster' or 'svg' (see init_fretboard).
+    :param canvas: Image to draw on instead of a new one (see init_fretboard).
+    :return: The draw object, with the rendered image in draw.image.
+    """
+    spec = normalize_spec(spec)
+    draw = init_fretboard(spec_instrument(spec), backend, canvas)
+    for layer in spec['layers']:
+        draw = layer_renderers[layer['type']](draw, layer)
+    return draw
 
-# Draw a complex arpeggio, for example, a 'maj9#11'
-# draw_arpeggio(init_fretboard(), 'C#', 'maj9#11').show()
+# Function to normalize a sheet spec into one diagram spec per panel
+def normalize_sheet(sheet):
+    """
+    Normalize a sheet: a grid of panels that share an optional base layer.
 
-# Save the image
-# draw_arpeggio(init_fretboard(), 'C#', 'maj9#11').save('7_string_fretboard_complex_arpeggio.png')
+    A sheet is a list of panels, or a dict with 'panels' plus optional 'base' (a layer dict
+    or a list of them, drawn first on every panel; a base scale is drawn in black like in
+    normalize_spec), 'instrument', 'pixel_scale' and 'columns'. A panel is a layer dict (e.g. a chord
+    overlay), a list of layer dicts, or a full diagram spec (see normalize_spec).
 
+    Example:
+    {'base': {'root': 'D#', 'scale': 'harmonic_minor'},
+     'panels': [{'root': 'D#', 'chord': 'minmaj7'}, {'root': 'F', 'chord': 'min7b5'}]}
 
-# merged_image = merge_images_vertically(
-#     [draw_scale(init_fretboard(), 'A', 'harmonic_minor'),
-#     draw_scale(init_fretboard(), 'D', ['dorian',0]),
-#     draw_scale(init_fretboard(), 'E', ['phrygian_dominant',0]),
-#     draw_scale(init_fretboard(), 'F', ['lydian',0]),
-#     draw_scale(init_fretboard(), 'B', ['locrian',0]),
-#     draw_scale(init_fretboard(), 'A', ['harmonic_minor',0])])
+    :param sheet: Sheet spec.
+    :return: {'panels': [diagram spec, ...], 'columns': int}, each spec already normalized.
+    """
+    if isinstance(sheet, list):
+        sheet = {'panels': sheet}
+    panels = sheet.get('panels')
+    if not panels:
+        raise ValueError("A sheet needs a non-empty 'panels' list.")
+    base = sheet.get('base') or []
+    base_layers = [normalize_layer(layer, default_type='black_scale') for layer in (base if isinstance(base, list) else [base])]
+    columns = int(sheet.get('columns', 2))
+    if columns < 1:
+        raise ValueError("The number of columns must be at least 1.")
+
+    specs = []
+    for panel in panels:
+        if isinstance(panel, list):
+            spec = {'layers': [normalize_layer(layer) for layer in panel]}
+        else:
+            spec = normalize_spec(panel)  # Keeps a panel's own 'instrument' and 'pixel_scale'
+        spec['layers'] = base_layers + spec['layers']
+        instrument = spec.get('instrument', sheet.get('instrument'))
+        if instrument is not None:
+            get_instrument(instrument)  # Validate it
+            spec['instrument'] = instrument
+        pixel_scale = spec.get('pixel_scale', sheet.get('pixel_scale'))
+        if pixel_scale not in (None, 1):
+            spec['pixel_scale'] = float(pixel_scale)
+        spec_instrument(spec)  # Validate the size of the diagram (see max_image_pixels)
+        specs.append(spec)
+    return {'panels': specs, 'columns': columns}
+
+# Function to read a sheet spec from a JSON or YAML file
+def load_sheet(path):
+    with open(path) as f:
+        text = f.read()
+    if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        # PyYAML is optional: without it, sheet specs can only be read from JSON
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML sheets needs PyYAML (pip install pyyaml); use JSON otherwise.") from None
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+# Function to render every panel of a sheet, drawing each shared layer stack only once
+def render_panels(sheet, backend='raster'):
+    """
+    Render the panels of a sheet (see normalize_sheet) into a list; see iter_panels.
+    """
+    return list(iter_panels(sheet, backend))
 
+# Function to render the panels of a sheet one at a time
+def iter_panels(sheet, backend='raster'):
+    """
+    Render the panels of a sheet (see normalize_sheet), yielding them in order.
 
-# merged_image = merge_images_vertically(
-#     [
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D#', 'minmaj7').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'F', '7b5').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'F#', 'maj7#5').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D', ['sus4', 0]).image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'A#', ['sus4', 0]).image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'B', 'minmaj7').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D', 'dim').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D#', 'minmaj7').image
-# ]
-# )
+    Panels are treated as stacks of layers. Every prefix shared by more than one panel
+    (the neck plus the base scale, say) is rendered once and kept; each panel starts
+    from a copy of its longest shared prefix and only draws the layers after it, and
+    identical panels are copies of one render.
 
+    Only the shared prefixes and the current panel are held in memory, so a long sheet can be
+    streamed into compose_grid(output=...).
 
+    :param sheet: Sheet spec.
+    :param backend: 'raster' or 'svg' (see init_fretboard).
+    :return: Generator of draw objects, one per panel in order.
+    """
+    specs = normalize_sheet(sheet)['panels']
+    stacks = []
+    for spec in specs:
+        instrument_key = json.dumps([spec.get('instrument'), spec.get('pixel_scale', 1)], sort_keys=True)
+        stacks.append((instrument_key,) + tuple(json.dumps(layer, sort_keys=True) for layer in spec['layers']))
+    # Count how many panels use each prefix, so only shared ones are kept
+    uses = {}
+    for stack in stacks:
+        for depth in range(1, len(stack) + 1):
+            uses[stack[:depth]] = uses.get(stack[:depth], 0) + 1
+
+    # A shared prefix is only kept if some panel branches off (or ends) there; a prefix
+    # whose every user continues to the same next layer is never a starting point
+    def keep(stack, depth):
+        prefix = stack[:depth]
+        return uses[prefix] > 1 and (depth == len(stack) or uses[stack[:depth + 1]] < uses[prefix])
+
+    rendered = {}
+    for spec, stack in zip(specs, stacks):
+        depth = len(stack)
+        while depth > 1 and stack[:depth] not in rendered:
+            depth -= 1
+        if stack[:depth] in rendered:
+            draw = copy_draw(rendered[stack[:depth]])
+        else:
+            draw = init_fretboard(spec_instrument(spec), backend)
+            if keep(stack, 1):
+                rendered[stack[:1]] = copy_draw(draw)
+        for index in range(depth, len(stack)):
+            draw = layer_renderers[spec['layers'][index - 1]['type']](draw, spec['layers'][index - 1])
+            if keep(stack, index + 1):
+                rendered[stack[:index + 1]] = copy_draw(draw)
+        yield draw
+
+# Function to render a sheet into one grid image (or SVG document)
+def render_sheet(sheet, backend='raster', output=None, dpi=None):
+    """
+    Render a sheet spec (see normalize_sheet) as a grid of panels.
+
+    With an output file the panels are rendered one at a time and each row is encoded as
+    soon as it is complete, so memory is bounded by one row of panels however long the
+    sheet is (e.g. a print book with pixel_scale 4 and columns 1). Panels of different
+    sizes (e.g. guitar and bass panels) are laid out like merge_images_grid instead, which
+    holds every panel in memory.
+
+    :param sheet: Sheet spec, or a path to a JSON/YAML file holding one.
+    :param backend: 'raster' for a Pillow image, or 'svg' for an SVG document string.
+    :param output: Path or binary file to stream the PNG to (raster only), as in compose_grid.
+    :param dpi: Resolution recorded in the streamed PNG, for print.
+    :return: The grid image (or output), or the SVG document.
+    """
+    if isinstance(sheet, (str, os.PathLike)):
+        sheet = load_sheet(sheet)
+    normalized = normalize_sheet(sheet)
+    draws = iter_panels(sheet, backend)
+    if backend == 'svg':
+        return merge_svg_grid(draws, normalized['columns'])
+    if len({spec_instrument(spec).image_size for spec in normalized['panels']}) > 1:
+        image = merge_images_grid([draw.image for draw in draws], normalized['columns'])
+        if output is None:
+            return image
+        image.save(output, format='PNG', **({'dpi': (dpi, dpi)} if dpi else {}))
+        return output
+    return compose_grid(draws, normalized['columns'], count=len(normalized['panels']), output=output, dpi=dpi)
+
+# Animation formats by file extension, as Pillow format names
+animation_formats = {'.gif': 'GIF', '.png': 'PNG', '.apng': 'PNG', '.webp': 'WEBP'}
+
+# Function to build one palette shared by every frame, from the most used colours
+def _shared_palette(images, colors=256):
+    counts = {}
+    for image in images:
+        for count, color in image.getcolors(image.width * image.height):
+            counts[color] = counts.get(color, 0) + count
+    palette = Image.new('P', (1, 1))
+    palette.putpalette([channel for color in heapq.nlargest(colors, counts, key=counts.get) for channel in color])
+    return palette
+
+# Function to render a sequence of overlays over one neck as an animated GIF, APNG or WebP
+def render_animation(frames, output, format=None, duration=1000, loop=0, colors=256):
+    """
+    Render the panels of a sheet (see normalize_sheet) as the frames of one animation.
+
+    The neck and any shared base layer are drawn once (see render_panels), so each frame
+    only draws its own overlay. Pillow's GIF and APNG writers store every frame after the
+    first as the box that changed since the previous one; GIF frames also share a single
+    global palette built from the colours of all frames.
+
+    Example, one frame per zone:
+    render_animation({'panels': [{'zones': [zone]} for zone in zones]}, 'zones.gif')
+
+    :param frames: Sheet spec (or a list of panels), or a path to a JSON/YAML sheet file.
+    :param output: Path or binary file to write to.
+    :param format: 'GIF', 'PNG' (APNG) or 'WEBP'; guessed from the output extension if None.
+    :param duration: Display time of each frame in ms (or a list, one per frame).
+    :param loop: Number of loops, 0 for forever.
+    :param colors: Size of the shared GIF palette.
+    :return: output.
+    """
+    if isinstance(frames, (str, os.PathLike)):
+        frames = load_sheet(frames)
+    if format is None:
+        extension = os.path.splitext(output if isinstance(output, (str, os.PathLike)) else '')[1].lower()
+        if extension not in animation_formats:
+            raise ValueError(f"Cannot tell the animation format from '{output}'; pass format='GIF', 'PNG' or 'WEBP'.")
+        format = animation_formats[extension]
+    images = [draw.image for draw in render_panels(frames)]
+
+    if format == 'GIF':
+        palette = _shared_palette(images, colors)
+        images = [image.quantize(palette=palette, dither=Image.Dither.NONE) for image in images]
+        # The palette is already shared and trimmed, so skip the per-frame palette optimization
+        options = {'optimize': False}
+    else:
+        options = {}
+    options.update(save_all=True, append_images=images[1:], duration=duration, loop=loop)
+    if format == 'PNG':
+        # Each frame is drawn over the previous one, so the encoder can store only the changed box
+        options.update(disposal=0, blend=0)
+    elif format == 'WEBP':
+        options.update(lossless=True, minimize_size=True)
+    with timed_phase('encode'):
+        images[0].save(output, format=format, **options)
+    return output
+
+# Result of rendering one batch item: the image (or output path) or the error message
+BatchResult = namedtuple('BatchResult', ['spec', 'image', 'path', 'error'])
+
+def _render_batch_item(spec, backend='raster', palette=False):
+    try:
+        image = render_spec(spec, backend).image
+        path = spec.get('output')
+        if path and backend == 'raster':
+            encode_png(image, path, palette=palette)
+            return BatchResult(spec, None, path, None)
+        if path:
+            image.save(path)
+            return BatchResult(spec, None, path, None)
+        return BatchResult(spec, image, None, None)
+    except Exception as error:
+        return BatchResult(spec, None, None, f"{type(error).__name__}: {error}")
+
+# Executors render_batch and iter_render_batch can spread the work over, by concurrent.futures class name
+batch_executors = {'process': 'ProcessPoolExecutor', 'thread': 'ThreadPoolExecutor'}
+
+# Function to create a batch executor; concurrent.futures is imported here, not with this module
+def new_executor(executor='process', workers=None):
+    import concurrent.futures
+    if executor not in batch_executors:
+        raise ValueError(f"Unknown executor '{executor}'.")
+    return getattr(concurrent.futures, batch_executors[executor])(max_workers=workers)
+
+# Function to render many diagrams, optionally across a process pool
+def render_batch(specs, workers=None, chunksize=4, executor='process'):
+    """
+    Render a list of diagram specs, spreading the work over a process pool.
+
+    Specs with an 'output' path are saved there and their result carries the path;
+    otherwise the result carries the rendered Pillow image. A failing spec does not
+    stop the batch: its result has the error message and no image.
+
+    :param specs: List of diagram specs (see normalize_spec).
+    :param workers: Number of worker processes (defaults to the CPU count); 1 renders serially in this process.
+    :param chunksize: Number of specs sent to a worker at a time.
+    :param executor: 'process', or 'thread' to render in threads of this process (Pillow releases
+                     the GIL while drawing, pasting and encoding, and nothing is copied between processes).
+    :return: List of BatchResult(spec, image, path, error), in the same order as specs.
+    """
+    specs = list(specs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(specs))
+    if workers <= 1:
+        return [_render_batch_item(spec) for spec in specs]
+    with new_executor(executor, workers) as pool:
+        return list(pool.map(_render_batch_item, specs, chunksize=chunksize))
+
+# Function to render a stream of diagrams, yielding each result as soon as it is done
+def iter_render_batch(specs, workers=None, backend='raster', window=None, palette=False, executor='process'):
+    """
+    Render diagram specs and yield BatchResult objects in completion order.
 
+    Unlike render_batch, specs are read lazily (e.g. from stdin) and only a window of them
+    is in flight at a time, so results stream out while the input is still being read.
 
-merged_image = merge_images_grid(
-    [
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'D#', 'minmaj7').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'F', 'min7b5').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'F', 'maj7#5').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'G#', 'min7').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'A#', 'dom7').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'B', 'maj7').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'D', 'dim').image,
-    draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'harmonic_minor'), 'D#', 'minmaj7').image
-]
-)
-merged_image.show()  # Display the merged image
-
-merged_image = merge_images_grid(
-    [
-    draw_arpeggio(draw=init_fretboard(),root_note = 'C', arpeggio_type = 'minmaj7').image,
-    draw_arpeggio(draw=init_fretboard(),root_note = 'A', arpeggio_type = 'min6add9').image,
-    draw_arpeggio(draw=init_fretboard(),root_note = 'F#', arpeggio_type = 'minmaj7').image,
-    draw_arpeggio(draw=init_fretboard(),root_note = 'D#', arpeggio_type = 'min9').image,
+    :param specs: Iterable of diagram specs (see normalize_spec); give them an 'output' path to save them in the worker.
+    :param workers: Number of worker processes (defaults to the CPU count); 1 renders serially in this process.
+    :param backend: 'raster' or 'svg' (see init_fretboard).
+    :param window: Maximum number of specs submitted but not yet yielded (defaults to 4 per worker).
+    :param palette: Save PNG outputs as palette images (see encode_png).
+    :param executor: 'process' or 'thread' (see render_batch).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for spec in specs:
+            yield _render_batch_item(spec, backend, palette)
+        return
+    from concurrent.futures import FIRST_COMPLETED, wait
+    window = window or 4 * workers
+    specs = iter(specs)
+    with new_executor(executor, workers) as pool:
+        pending = set()
+        while True:
+            for spec in specs:
+                pending.add(pool.submit(_render_batch_item, spec, backend, palette))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# Bytes per pixel of the raw export modes: RGB, or RGBA with an opaque alpha byte
+raw_modes = {'RGB': 3, 'RGBA': 4}
+
+# Function to get the array shape of a spec's diagram in a raw export mode
+def export_shape(spec, mode='RGB'):
+    """
+    Return the (height, width, channels) of the raw pixels of a diagram spec, without rendering it,
+    e.g. to allocate np.memmap('frames.raw', np.uint8, 'w+', shape=(count,) + export_shape(spec, 'RGBA')).
+    """
+    if mode not in raw_modes:
+        raise ValueError(f"Unknown raw mode '{mode}'.")
+    width, height = spec_instrument(normalize_spec(spec)).image_size
+    return (height, width, raw_modes[mode])
+
+# Function to get the raw pixels of a diagram without encoding them
+def export_buffer(diagram, mode='RGB'):
+    """
+    Return the pixels of a rendered diagram as a flat memoryview of bytes, row by row.
+
+    :param diagram: Draw object or Pillow image.
+    :param mode: 'RGB' (3 bytes per pixel) or 'RGBA' (4 bytes, alpha always 255).
+    :return: Read-only memoryview of height * width * channels bytes.
+    """
+    if mode not in raw_modes:
+        raise ValueError(f"Unknown raw mode '{mode}'.")
+    image = _as_image(diagram)
+    if image.mode != mode:
+        image = image.convert(mode)
+    return memoryview(image.tobytes())
+
+# Function to get the pixels of a diagram as a NumPy array
+def export_array(diagram, mode='RGB'):
+    """
+    Return the pixels of a rendered diagram as a read-only (height, width, channels) uint8
+    array; it is a view on export_buffer(diagram, mode), not a further copy.
+    """
+    _require_numpy()
+    image = _as_image(diagram)
+    return np.frombuffer(export_buffer(image, mode), dtype=np.uint8).reshape(image.height, image.width, raw_modes[mode])
+
+# Function to render one diagram into its slot of a raw buffer
+def _render_into_slot(spec, slot, size, mode):
+    try:
+        if mode == 'RGBA':
+            # Check the spec and its size first, so an invalid spec leaves the slot untouched
+            spec = normalize_spec(spec)
+            if spec_instrument(spec).image_size != size:
+                raise ValueError(f"The diagram is {spec_instrument(spec).image_size}, the slots hold {size}.")
+            # An image mapped onto the slot: the neck is pasted and every layer drawn straight
+            # into the caller's memory. frombuffer images are read-only (Pillow would copy on the
+            # first write), and clearing the flag is not a documented Pillow API, so the result is
+            # checked below and copied over if Pillow drew into a private copy after all.
+            canvas = Image.frombuffer('RGBA', size, slot, 'raw', 'RGBA', 0, 1)
+            canvas.readonly = 0
+            mapped = canvas.im
+            draw = render_spec(spec, canvas=canvas)
+            draw.image.putalpha(255)  # Antialiased note edges blend into the alpha band too
+            # Copy-on-write replaces the image's core object, detaching it from the slot
+            if draw.image is not canvas or canvas.im is not mapped or canvas.readonly:
+                slot[:] = export_buffer(draw, mode)
+        else:
+            image = render_spec(spec).image
+            if image.size != size:
+                raise ValueError(f"The diagram is {image.size}, the slots hold {size}.")
+            slot[:] = export_buffer(image, mode)
+        return BatchResult(spec, None, None, None)
+    except Exception as error:
+        return BatchResult(spec, None, None, f"{type(error).__name__}: {error}")
+
+# Function to render a batch of diagrams into a caller-provided array or memory-mapped file
+def render_into(specs, out, mode='RGB', stride=None, offset=0, workers=1):
+    """
+    Render diagram specs as raw pixels into a preallocated buffer, one fixed-size slot per diagram.
+
+    Diagram i is written at byte offset + i * stride as height rows of width * channels bytes,
+    so out can be a NumPy array shaped (count, height, width, channels) (see export_shape),
+    an np.memmap, a bytearray or an mmap.mmap feeding a video encoder. Nothing is encoded.
+    In 'RGBA' mode the diagrams are drawn directly in the slots, without any per-image copy;
+    in 'RGB' mode each rendered image is packed to 3 bytes per pixel and copied into its slot.
+
+    Every diagram must have the size of the first one. A failing spec does not stop the
+    batch: its result has the error message. An invalid spec leaves its slot as it was, but
+    in 'RGBA' mode an error while drawing can leave a partly drawn diagram in the slot.
+
+    :param specs: Iterable of diagram specs (see normalize_spec).
+    :param out: Writable C-contiguous buffer.
+    :param mode: 'RGB' or 'RGBA' (alpha always 255).
+    :param stride: Bytes from one slot to the next (defaults to the size of one diagram).
+    :param offset: Byte offset of the first slot (e.g. past a file header).
+    :param workers: Number of threads rendering slots in parallel; slots never overlap.
+    :return: List of BatchResult(spec, None, None, error), in the same order as specs.
+    """
+    if mode not in raw_modes:
+        raise ValueError(f"Unknown raw mode '{mode}'.")
+    view = memoryview(out)
+    if view.readonly:
+        raise ValueError("render_into needs a writable buffer.")
+    if not view.c_contiguous:
+        raise ValueError("render_into needs a C-contiguous buffer.")
+    view = view.cast('B')
+    specs = iter(specs)
+    first = next(specs, None)
+    if first is None:
+        return []
+    height, width, channels = export_shape(first, mode)
+    size = height * width * channels
+    stride = size if stride is None else stride
+    if stride < size:
+        raise ValueError(f"The stride ({stride} bytes) is smaller than one diagram ({size} bytes).")
+
+    def slots():
+        for index, spec in enumerate(itertools.chain([first], specs)):
+            start = offset + index * stride
+            if start + size > view.nbytes:
+                raise ValueError(f"The buffer has room for {index} diagrams of {size} bytes at stride {stride}.")
+            yield spec, view[start:start + size]
+
+    if workers <= 1:
+        return [_render_into_slot(spec, slot, (width, height), mode) for spec, slot in slots()]
+    with new_executor('thread', workers) as pool:
+        futures = [pool.submit(_render_into_slot, spec, slot, (width, height), mode) for spec, slot in slots()]
+        return [future.result() for future in futures]
+
+
+# Bump when a change to the drawing code changes the pixels of existing diagrams
+render_version = 2
+
+# Function to describe everything besides the spec that affects a rendered diagram
+def render_settings():
+    # The font actually loaded, which is a fallback font when font_path is missing
+    return {'version': render_version, 'font_path': getattr(get_font(), 'path', 'default'), 'fontsize': fontsize}
+
+# Function to get a content hash of a diagram spec
+def spec_hash(spec):
+    """
+    Hash a diagram spec after normalization, so equivalent specs share one hash.
+
+    The hash covers the resolved intervals of every layer, the instrument settings and
+    render_settings(), so it changes when a registered pattern or the rendering changes.
+    """
+    spec = normalize_spec(spec)
+    payload = {
+        'spec': spec,
+        'intervals': [layer_intervals(layer) for layer in spec['layers']],
+        'instrument': get_instrument(spec.get('instrument')).key,
+        'settings': render_settings(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+# PNG settings of the palette output mode (see encode_png)
+png_palette_colors = 256
+png_palette_method = Image.Quantize.FASTOCTREE
+png_compress_level = 6
+
+# Function to convert a diagram to a palette image, exactly when it has few enough colours
+def to_palette(image, colors=None):
+    """
+    Convert an RGB image to "P" mode deterministically.
+
+    If the image has at most colors distinct colours the conversion is lossless (Pillow's
+    max-coverage quantizer keeps every colour when they fit). Otherwise (antialiased text and
+    circles usually add a few hundred shades) it uses the faster png_palette_method, without
+    dithering.
+
+    :param image: RGB Pillow image.
+    :param colors: Maximum palette size (defaults to png_palette_colors).
+    """
+    colors = colors or png_palette_colors
+    if image.getcolors(colors) is not None:
+        return image.quantize(colors, method=Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+    return image.quantize(colors, method=png_palette_method, dither=Image.Dither.NONE)
+
+# Function to encode a diagram as PNG, optionally as a palette image
+def encode_png(image, fp=None, palette=False, colors=None, compress_level=None):
+    """
+    Encode an image as PNG. The bytes only depend on the pixels and these settings.
+
+    :param image: Pillow image (or draw object).
+    :param fp: Path or binary file to write to; None returns the bytes.
+    :param palette: Write a "P" mode PNG (see to_palette): usually about half the size and several times faster to encode.
+    :param colors: Palette size for palette=True.
+    :param compress_level: zlib level (defaults to png_compress_level).
+    """
+    image = _as_image(image)
+    buffer = io.BytesIO() if fp is None else fp
+    with timed_phase('encode'):
+        if palette:
+            image = to_palette(image, colors)
+        level = png_compress_level if compress_level is None else compress_level
+        image.save(buffer, format='PNG', compress_level=level)
+    return buffer.getvalue() if fp is None else fp
+
+# Function to render a diagram spec straight to PNG bytes
+def render_png(spec, palette=False):
+    return encode_png(render_spec(spec).image, palette=palette)
+
+# Function to render a diagram spec to palette PNG bytes
+def render_png8(spec):
+    return render_png(spec, palette=True)
+
+# Function to render a diagram spec to SVG bytes
+def render_svg(spec):
+    return render_spec(spec, backend='svg').tostring().encode('utf-8')
+
+# Output formats served by DiagramService: renderer and content type
+diagram_formats = {
+    'png': (render_png, 'image/png'),
+    'png8': (render_png8, 'image/png'),
+    'svg': (render_svg, 'image/svg+xml'),
+}
+
+# Function to build a diagram spec from URL query parameters
+def spec_from_query(query):
+    """
+    Build a diagram spec from a query string such as
+    root=D%23&scale=harmonic_minor&overlay=F:min7b5&overlay=D:sus4:0&instrument=guitar7
+
+    Each overlay is root:chord or root:chord:axis, and mode=2 picks a mode of the scale.
+    """
+    from urllib.parse import parse_qs
+    params = parse_qs(query)
+    spec = {}
+    for key in ('root', 'scale', 'chord', 'type', 'instrument'):
+        if key in params:
+            spec[key] = params[key][-1]
+    if 'axis' in params:
+        spec['axis'] = int(params['axis'][-1])
+    if 'mode' in params:
+        spec['mode'] = int(params['mode'][-1])
+    if 'pixel_scale' in params:
+        spec['pixel_scale'] = float(params['pixel_scale'][-1])
+    overlays = []
+    for overlay in params.get('overlay', []):
+        parts = overlay.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Overlay '{overlay}' must be root:chord or root:chord:axis.")
+        layer = {'root': parts[0], 'chord': parts[1]}
+        if len(parts) == 3:
+            layer['axis'] = int(parts[2])
+        overlays.append(layer)
+    if overlays:
+        spec['overlays'] = overlays
+    return spec
+
+# Diagram rendering service with an in-memory LRU, a disk cache and request collapsing
+class DiagramService:
+    """
+    Serve PNG (or SVG) diagrams by content hash.
+
+    Lookups go to an in-memory LRU first, then to a content-addressed directory of files,
+    and only then to a render in the executor. Concurrent requests for the same diagram
+    wait for a single render. Counters are kept in stats.
+    """
+    max_body_bytes = 64 * 1024  # Largest POST body read; larger requests get 413
+    def __init__(self, cache_dir=None, memory_items=256, executor=None):
+        """
+        :param cache_dir: Directory for the on-disk PNG cache (None disables it).
+        :param memory_items: Number of PNGs kept in memory.
+        :param executor: concurrent.futures executor used to render (defaults to a process pool).
+        """
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.executor = executor if executor is not None else new_executor('process')
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self.stats = {'requests': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'collapsed': 0, 'errors': 0}
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, data):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    async def get_png(self, spec):
+        """
+        Return (hash, PNG bytes) for a diagram spec, rendering it only if no cache has it.
+        """
+        return await self.get_diagram(spec, 'png')
+
+    async def get_diagram(self, spec, fmt='png'):
+        """
+        Return (hash, bytes) for a diagram spec in a format from diagram_formats.
+        """
+        import asyncio
+        if fmt not in diagram_formats:
+            raise ValueError(f"Unknown format '{fmt}'.")
+        self.stats['requests'] += 1
+        try:
+            key = f"{spec_hash(spec)}.{fmt}"
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return key, data
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats['collapsed'] += 1
+            return key, await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        pending = self._inflight[key] = loop.create_future()
+        try:
+            data = await loop.run_in_executor(None, self._read_disk, key)
+            if data is not None:
+                self.stats['disk_hits'] += 1
+            else:
+                self.stats['misses'] += 1
+                data = await loop.run_in_executor(self.executor, diagram_formats[fmt][0], spec)
+                await loop.run_in_executor(None, self._write_disk, key, data)
+            self._remember(key, data)
+            pending.set_result(data)
+            return key, data
+        except Exception as error:
+            self.stats['errors'] += 1
+            pending.set_exception(error)
+            pending.exception()  # Mark it retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+            if not pending.done():
+                # This request was cancelled mid-render: fail the collapsed requests rather than leave them waiting
+                pending.set_exception(RuntimeError("The render was cancelled."))
+                pending.exception()
+
+    async def handle(self, reader, writer):
+        """
+        Handle one HTTP/1.1 request (GET /render?..., POST /render with a JSON spec, GET /stats).
+        /render.svg serves the same diagrams as SVG and /render.png8 as palette PNGs.
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return
+            from urllib.parse import urlsplit
+            method, target = request_line[0], urlsplit(request_line[1])
+
+            if target.path == '/stats' and method == 'GET':
+                body = json.dumps(dict(self.stats, memory_items=len(self._memory))).encode()
+                await self._respond(writer, 200, body, 'application/json')
+            elif target.path in ('/render', '/render.png', '/render.png8', '/render.svg') and method in ('GET', 'POST'):
+                fmt = target.path.rpartition('.')[2] if '.' in target.path else 'png'
+                try:
+                    if method == 'POST':
+                        length = int(headers.get('content-length', 0))
+                        if length > self.max_body_bytes:
+                            await self._respond(writer, 413, f"The body is limited to {self.max_body_bytes} bytes.\n".encode(), 'text/plain')
+                            return
+                        if length < 0:
+                            raise ValueError("Invalid Content-Length.")
+                        spec = json.loads(await reader.readexactly(length))
+                        if not isinstance(spec, dict):
+                            raise ValueError("The request body must be a JSON object (a diagram spec).")
+                    else:
+                        spec = spec_from_query(target.query)
+                    key, data = await self.get_diagram(spec, fmt)
+                except (ValueError, KeyError, TypeError) as error:
+                    await self._respond(writer, 400, f"{error}\n".encode(), 'text/plain')
+                    return
+                etag = f'"{key}"'
+                if headers.get('if-none-match') == etag:
+                    await self._respond(writer, 304, b'', None, {'ETag': etag})
+                else:
+                    await self._respond(writer, 200, data, diagram_formats[fmt][1],
+                                        {'ETag': etag, 'Cache-Control': 'public, max-age=86400'})
+            else:
+                await self._respond(writer, 404, b'Not found\n', 'text/plain')
+        except Exception as error:
+            await self._respond(writer, 500, f"{type(error).__name__}: {error}\n".encode(), 'text/plain')
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body, content_type, extra_headers=None):
+        reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 413: 'Content Too Large',
+                   500: 'Internal Server Error'}
+        lines = [f"HTTP/1.1 {status} {reasons[status]}", f"Content-Length: {len(body)}", "Connection: close"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        for name, value in (extra_headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+# Function to run the rendering service
+def serve(host='127.0.0.1', port=8000, cache_dir='fretboard_cache', memory_items=256, workers=None, executor='process'):
+    """
+    Run the HTTP rendering service until interrupted.
+
+    Endpoints: GET /render?root=C&scale=major (see spec_from_query), POST /render with a
+    JSON diagram spec, /render.svg and /render.png8 for SVG and palette PNG output, and GET /stats for the hit/miss counters.
+    """
+    import asyncio
+
+    async def main():
+        with new_executor(executor, workers) as pool:
+            service = DiagramService(cache_dir, memory_items, pool)
+            server = await asyncio.start_server(service.handle, host, port)
+            print(f"Serving fretboard diagrams on http://{host}:{port}/render", file=sys.stderr)
+            async with server:
+                await server.serve_forever()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+# Function to name the chords stacked in thirds on the degrees of a pattern (cached per chord registry version)
+@lru_cache(maxsize=None)
+def _degree_chords(intervals, chords_version):
+    pitches = sorted({note % 12 for note in intervals})
+    index = get_pattern_index()
+    chords = []
+    for degree, offset in enumerate(pitches, 1):
+        # Try the seventh chord first, then the triad
+        for size in (4, 3):
+            stack = [pitches[(degree - 1 + 2 * step) % len(pitches)] for step in range(size)]
+            names = [match.name for match in index.exact(pattern_mask(stack), 'chord')
+                     if match.root == chromatic_scale[offset]]
+            if names:
+                chords.append((degree, offset, names[0]))
+                break
+    return tuple(chords)
+
+# Function to find the chord of every degree of a scale
+def degree_chords(scale_type):
+    """
+    Harmonize a scale: stack every other note on each degree and name the chord it spells.
+
+    Parameters:
+    scale_type (str or list): Name of the scale, or [name, axis] for an inversion.
+
+    Returns:
+    list: (degree, semitones above the root, chord name) tuples; degrees whose stack is not a
+    registered seventh chord or triad are left out.
+    """
+    pattern = scale_registry.lookup(scale_type)
+    if pattern is None:
+        raise ValueError(f"Unknown scale '{scale_type}'.")
+    return list(_degree_chords(pattern, chord_registry.version))
+
+# Function to turn a note name into a file name part ('C#' -> 'Cs')
+def _file_note(note):
+    return note.replace('#', 's')
+
+# Function to list every diagram of the scale catalogue
+def catalogue_specs(scales=None, roots=None, modes=True, inversions=True, arpeggios=True):
+    """
+    Generate the entries of the scale catalogue as (relative path, diagram spec) pairs.
+
+    For every scale and root the catalogue has the scale itself (<scale>/<root>), its modes
+    (<scale>/modes/<root>-mode<n>, rooted on the degree each mode starts on), its inversions
+    around every axis (<scale>/inversions/<root>-axis<n>) and the chord of each degree drawn
+    over the scale in black (<scale>/arpeggios/<root>-<degree>-<chord>, see degree_chords).
+    Paths have no extension; '#' is written 's' so they are safe in URLs.
+
+    :param scales: Scale names (defaults to every registered scale).
+    :param roots: Root notes (defaults to all 12).
+    :param modes: Include the modes.
+    :param inversions: Include the inversions.
+    :param arpeggios: Include the degree arpeggios.
+    """
+    for name in scales or scale_registry.names():
+        pattern = scale_registry.lookup(name)
+        if pattern is None:
+            raise ValueError(f"Unknown scale '{name}'.")
+        chords = degree_chords(name) if arpeggios else []
+        for root in roots or chromatic_scale:
+            root_index = note_to_index[root]
+            yield f"{name}/{_file_note(root)}", {'root': root, 'scale': name}
+            if modes:
+                # A degree repeating an earlier pitch class (an octave) starts no new mode
+                for degree in range(2, len(pattern) + 1):
+                    if pattern[degree - 1] % 12 in {note % 12 for note in pattern[:degree - 1]}:
+                        continue
+                    mode_root = chromatic_scale[(root_index + pattern[degree - 1]) % 12]
+                    yield (f"{name}/modes/{_file_note(root)}-mode{degree}",
+                           {'root': mode_root, 'scale': name, 'mode': degree})
+            if inversions:
+                for axis in range(12):
+                    yield f"{name}/inversions/{_file_note(root)}-axis{axis}", {'root': root, 'scale': name, 'axis': axis}
+            for degree, offset, chord in chords:
+                yield (f"{name}/arpeggios/{_file_note(root)}-{degree}-{chord}",
+                       {'root': root, 'scale': name,
+                        'overlays': [{'root': chromatic_scale[(root_index + offset) % 12], 'chord': chord}]})
+
+# Name of the manifest file build_catalogue keeps in the output directory
+catalogue_manifest = 'manifest.json'
+
+# Function to read a catalogue manifest, or an empty one
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {'format': None, 'entries': {}}
+    return {'format': manifest.get('format'), 'entries': dict(manifest.get('entries', {}))}
+
+# Function to write a catalogue manifest atomically
+def _write_manifest(path, manifest):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary, path)
+
+# Function to build or update the scale catalogue, re-rendering only what changed
+def build_catalogue(output_dir, entries=None, format='png', workers=None, executor='process', progress=None):
+    """
+    Render a catalogue into output_dir, keeping a manifest of the spec hash of every file.
+
+    On each run only the entries whose spec_hash changed (their spec, the intervals of a
+    pattern they draw, the instrument or render_settings()) or whose file is missing are
+    rendered; files of entries that are no longer in the catalogue are deleted. Hashing the
+    whole catalogue takes a fraction of a second, so an update costs about as much as the
+    diagrams it re-renders. The manifest is saved even if the run is interrupted, so the
+    next run picks up where this one stopped.
+
+    :param output_dir: Directory of the catalogue (created if needed).
+    :param entries: Iterable of (relative path without extension, spec) pairs; defaults to catalogue_specs().
+    :param format: 'png', 'png8' (palette PNGs, see encode_png) or 'svg'. Changing it re-renders everything.
+    :param workers: Number of worker processes (see iter_render_batch).
+    :param executor: 'process' or 'thread' (see render_batch).
+    :param progress: Optional callback called with each BatchResult.
+    :return: Dict with the number of entries, rendered, unchanged, removed and failed ones, and the seconds taken.
+    """
+    if format not in ('png', 'png8', 'svg'):
+        raise ValueError(f"Unknown catalogue format '{format}'.")
+    started = time.perf_counter()
+    extension = 'svg' if format == 'svg' else 'png'
+    manifest_path = os.path.join(output_dir, catalogue_manifest)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _read_manifest(manifest_path)
+    previous = manifest['entries'] if manifest['format'] == format else {}
+
+    wanted = {}
+    pending = {}
+    for name, spec in (catalogue_specs() if entries is None else entries):
+        path = f"{name}.{extension}"
+        if path in wanted:
+            raise ValueError(f"Duplicate catalogue entry '{path}'.")
+        wanted[path] = spec_hash(spec)
+        full_path = os.path.join(output_dir, path)
+        if previous.get(path) != wanted[path] or not os.path.exists(full_path):
+            pending[full_path] = (path, dict(spec, output=full_path))
+
+    stats = {'entries': len(wanted), 'rendered': 0, 'unchanged': len(wanted) - len(pending), 'removed': 0, 'failed': 0}
+    # The manifest only lists files that match their hash: unchanged ones now, rendered ones as they finish
+    entries = {path: digest for path, digest in previous.items()
+               if wanted.get(path) == digest and os.path.join(output_dir, path) not in pending}
+
+    # Delete the files of entries that left the catalogue, and the directories they leave empty
+    for path in set(manifest['entries']) - set(wanted):
+        full_path = os.path.join(output_dir, path)
+        if os.path.exists(full_path):
+            os.remove(full_path)
+            stats['removed'] += 1
+        directory = os.path.dirname(full_path)
+        while os.path.abspath(directory) != os.path.abspath(output_dir) and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    for directory in {os.path.dirname(full_path) for full_path in pending}:
+        os.makedirs(directory, exist_ok=True)
+    try:
+        backend = 'svg' if format == 'svg' else 'raster'
+        for result in iter_render_batch((spec for _, spec in pending.values()), workers, backend,
+                                        palette=format == 'png8', executor=executor):
+            path = pending[result.spec['output']][0]
+            if result.error:
+                stats['failed'] += 1
+            else:
+                entries[path] = wanted[path]
+                stats['rendered'] += 1
+            if progress is not None:
+                progress(result)
+    finally:
+        _write_manifest(manifest_path, {'format': format, 'entries': entries})
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+# Example usage of draw_arpeggios_zones
+# [Note, chord, fret start, fret end, string start, string end]
+zones = [
+    # Diminished to Minor Resolution
+    ['C#', 'min', 9, 12, 1, 7], # C#m: Fret 9-12, Strings 1-6
+    ['C', 'dim', 8, 9, 1, 7],   # Cdim: Fret 8-9, Strings 1-6
+    ['B', 'min', 7, 9, 1, 7],   # Bm: Fret 7-9, Strings 1-6
+    ['E', 'aug', 1, 5, 1, 7], # Eaug: Fret 12-15, Strings 1-6
+    ['A', 'maj', 5, 8, 1, 7],   # Amaj: Fret 5-8, Strings 1-6
 ]
-)
-merged_image.show()  # Display the merged image
-
-
-# merged_image = merge_images_grid(
-#     [
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'E', arpeggio_type = 'maj').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'E', arpeggio_type = 'maj9').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'F#', arpeggio_type = 'maj').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'F#', arpeggio_type = 'add9').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'G#', arpeggio_type = 'min').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'G#', arpeggio_type = 'minadd9').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'C#', arpeggio_type = 'min').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'C#', arpeggio_type = 'min6add9').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'D#', arpeggio_type = 'min').image,
-#     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'D#', arpeggio_type = 'min7').image,
-# ]
-# )
-# merged_image.show()  # Display the merged image
+
 
 
 #############################################################
 #### EXAMPLES ######
 #############################################################
+
+def examples():
+    # Call the function to draw arpeggios in the specified zones
+    # draw_arpeggios_zones(init_fretboard(), zones).show()
+
+    # Draw a scale, for example, a 'C# major' scale
+    # draw_scale(draw, 'C#', 'major').show()
+
+    # Draw a complex arpeggio, for example, a 'maj9#11'
+    # draw_arpeggio(init_fretboard(), 'C#', 'maj9#11').show()
+
+    # Save the image
+    # draw_arpeggio(init_fretboard(), 'C#', 'maj9#11').save('7_string_fretboard_complex_arpeggio.png')
+
+
+    # merged_image = merge_images_vertically(
+    #     [draw_scale(init_fretboard(), 'A', 'harmonic_minor'),
+    #     draw_scale(init_fretboard(), 'D', ['dorian',0]),
+    #     draw_scale(init_fretboard(), 'E', ['phrygian_dominant',0]),
+    #     draw_scale(init_fretboard(), 'F', ['lydian',0]),
+    #     draw_scale(init_fretboard(), 'B', ['locrian',0]),
+    #     draw_scale(init_fretboard(), 'A', ['harmonic_minor',0])])
+
+
+    # merged_image = merge_images_vertically(
+    #     [
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D#', 'minmaj7').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'F', '7b5').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'F#', 'maj7#5').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D', ['sus4', 0]).image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'A#', ['sus4', 0]).image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'B', 'minmaj7').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D', 'dim').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'D#', 'hungarian_minor'), 'D#', 'minmaj7').image
+    # ]
+    # )
+
+
+
+
+    # Harmonized D# harmonic minor: the neck and the black scale are drawn once for all panels
+    merged_image = render_sheet({
+        'base': {'root': 'D#', 'scale': 'harmonic_minor'},
+        'panels': [
+            {'root': 'D#', 'chord': 'minmaj7'},
+            {'root': 'F', 'chord': 'min7b5'},
+            {'root': 'F', 'chord': 'maj7#5'},
+            {'root': 'G#', 'chord': 'min7'},
+            {'root': 'A#', 'chord': 'dom7'},
+            {'root': 'B', 'chord': 'maj7'},
+            {'root': 'D', 'chord': 'dim'},
+            {'root': 'D#', 'chord': 'minmaj7'},
+        ],
+    })
+    merged_image.show()  # Display the merged image
+
+    merged_image = merge_images_grid(
+        [
+        draw_arpeggio(draw=init_fretboard(),root_note = 'C', arpeggio_type = 'minmaj7').image,
+        draw_arpeggio(draw=init_fretboard(),root_note = 'A', arpeggio_type = 'min6add9').image,
+        draw_arpeggio(draw=init_fretboard(),root_note = 'F#', arpeggio_type = 'minmaj7').image,
+        draw_arpeggio(draw=init_fretboard(),root_note = 'D#', arpeggio_type = 'min9').image,
+    ]
+    )
+    merged_image.show()  # Display the merged image
+
+
+    # merged_image = merge_images_grid(
+    #     [
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'E', arpeggio_type = 'maj').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'E', arpeggio_type = 'maj9').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'F#', arpeggio_type = 'maj').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'F#', arpeggio_type = 'add9').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'G#', arpeggio_type = 'min').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'G#', arpeggio_type = 'minadd9').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'C#', arpeggio_type = 'min').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'C#', arpeggio_type = 'min6add9').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'D#', arpeggio_type = 'min').image,
+    #     draw_arpeggio(draw_black_scale(init_fretboard(), 'E', 'lydian'),root_note = 'D#', arpeggio_type = 'min7').image,
+    # ]
+    # )
+    # merged_image.show()  # Display the merged image
+
+
+#### COMMAND LINE ######
+
+# Function to parse one diagram spec given as JSON or as a query string (see spec_from_query)
+def parse_spec(text):
+    text = text.strip()
+    if text.startswith(('{', '[')) or text in ('null', 'true', 'false'):
+        spec = json.loads(text)
+        if not isinstance(spec, dict):
+            raise ValueError("A diagram spec must be a JSON object.")
+        return spec
+    if '=' not in text:
+        raise ValueError("Not a JSON object or a query string like root=C&scale=major")
+    return spec_from_query(text)
+
+# Function to read specs from a JSON lines file (or '-' for stdin), one spec per line
+def read_specs(fp, on_error=None):
+    """
+    Parse one spec per line, skipping blank lines and # comments.
+
+    :param fp: Text file.
+    :param on_error: Called with a message for each line that cannot be parsed, which is then
+                     skipped; without it the error is raised.
+    """
+    for number, line in enumerate(fp, 1):
+        if line.strip() and not line.lstrip().startswith('#'):
+            try:
+                spec = parse_spec(line)
+            except ValueError as error:
+                if on_error is None:
+                    raise
+                on_error(f"line {number}: {error}: {line.strip()}")
+                continue
+            yield spec
+
+# Function to render specs from the command line into an output directory
+def run_render(args):
+    parse_errors = []
+
+    def report(message):
+        parse_errors.append(message)
+        print(f"error: {message}", file=sys.stderr)
+
+    def specs():
+        for text in args.specs:
+            try:
+                yield parse_spec(text)
+            except ValueError as error:
+                report(f"{error}: {text}")
+        for path in args.file or ([] if args.specs or sys.stdin.isatty() else ['-']):
+            if path == '-':
+                yield from read_specs(sys.stdin, report)
+            else:
+                with open(path) as f:
+                    yield from read_specs(f, report)
+
+    extension = 'svg' if args.format == 'svg' else 'png'
+    # Output paths already submitted: a repeated spec is rendered (and its file written) only once
+    submitted = set()
+    duplicates = 0
+
+    def with_outputs():
+        nonlocal duplicates
+        for index, spec in enumerate(specs()):
+            spec = dict(spec)
+            if args.pixel_scale and 'pixel_scale' not in spec:
+                spec['pixel_scale'] = args.pixel_scale
+            if spec.get('output'):
+                name = spec['output']
+            else:
+                try:
+                    name = f"{spec_hash(spec)[:16]}.{extension}"
+                except (KeyError, TypeError, ValueError):
+                    name = f"spec-{index:05d}.{extension}"  # Invalid spec: the worker reports the error
+            spec['output'] = os.path.join(args.output_dir, name)
+            if spec['output'] in submitted:
+                duplicates += 1
+                continue
+            submitted.add(spec['output'])
+            yield spec
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    backend = 'svg' if args.format == 'svg' else 'raster'
+    started = time.perf_counter()
+    count = errors = written = 0
+    for result in iter_render_batch(with_outputs(), args.workers, backend, palette=args.format == 'png8',
+                                    executor='thread' if args.threads else 'process'):
+        count += 1
+        if result.error:
+            errors += 1
+            print(f"error: {result.error} in {json.dumps(result.spec)}", file=sys.stderr)
+        else:
+            written += os.path.getsize(result.path)
+            print(result.path, flush=True)
+    # Lines that could not be parsed are reported as they are read, and counted here
+    count += len(parse_errors)
+    errors += len(parse_errors)
+    elapsed = time.perf_counter() - started
+    if not args.quiet:
+        print(f"{count} diagrams ({errors} errors, {duplicates} duplicates skipped) in {elapsed:.2f} s, "
+              f"{count / elapsed if elapsed else 0:.1f} diagrams/s, {written / 1e6:.1f} MB written", file=sys.stderr)
+    return 1 if errors else 0
+
+# Function to render a sheet file (see render_sheet) to a PNG or SVG file
+def run_sheet(args):
+    backend = 'svg' if args.output.lower().endswith('.svg') else 'raster'
+    sheet = load_sheet(args.sheet)
+    if args.pixel_scale:
+        sheet = dict({'panels': sheet} if isinstance(sheet, list) else sheet, pixel_scale=args.pixel_scale)
+    result = render_sheet(sheet, backend, output=None if backend == 'svg' else args.output, dpi=args.dpi)
+    if backend == 'svg':
+        with open(args.output, 'w') as f:
+            f.write(result)
+    print(args.output)
+    return 0
+
+# Function to render a sheet file as an animation, one panel per frame
+def run_animate(args):
+    render_animation(args.sheet, args.output, duration=args.duration, loop=args.loop)
+    print(args.output)
+    return 0
+
+# Function to build or update the scale catalogue from the command line
+def run_catalogue(args):
+    def progress(result):
+        if result.error:
+            print(f"error: {result.error} in {json.dumps(result.spec)}", file=sys.stderr)
+        elif not args.quiet:
+            print(result.path, flush=True)
+
+    entries = catalogue_specs(args.scales, args.roots, not args.no_modes, not args.no_inversions, not args.no_arpeggios)
+    stats = build_catalogue(args.output_dir, entries, args.format, args.workers,
+                            'thread' if args.threads else 'process', progress)
+    print(f"{stats['entries']} entries: {stats['rendered']} rendered, {stats['unchanged']} unchanged, "
+          f"{stats['removed']} removed, {stats['failed']} failed in {stats['seconds']:.2f} s", file=sys.stderr)
+    return 1 if stats['failed'] else 0
+
+# Function to run the command line interface
+def main(argv=None):
+    """
+    Command line entry point: python fretboard.py (or python -m fretboard) <command>.
+
+    render: render specs given as arguments, in JSON lines files or on stdin, e.g.
+        python -m fretboard render 'root=C&scale=major' '{"root": "A", "chord": "min7"}' -o out
+        cat specs.jsonl | python -m fretboard render -w 4 -o out
+    sheet: render a JSON/YAML sheet spec to one PNG or SVG grid.
+    animate: render a sheet spec as an animated GIF, APNG or WebP, one panel per frame.
+    catalogue: build or update the scale catalogue (see build_catalogue), e.g.
+        python -m fretboard catalogue catalogue/ --scales major harmonic_minor
+    serve: run the HTTP rendering service.
+    examples: show the example diagrams (the default without a command).
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='fretboard', description='Render fretboard diagrams.')
+    commands = parser.add_subparsers(dest='command')
+
+    render = commands.add_parser('render', help='Render diagram specs to an output directory.')
+    render.add_argument('specs', nargs='*', help='Specs as JSON objects or query strings (root=C&scale=major&overlay=E:min).')
+    render.add_argument('-f', '--file', action='append', help="JSON lines file of specs ('-' for stdin); may be repeated.")
+    render.add_argument('-o', '--output-dir', default='.', help='Directory the diagrams are written to.')
+    render.add_argument('-w', '--workers', type=int, help='Number of worker processes (default: CPU count).')
+    render.add_argument('--format', choices=['png', 'png8', 'svg'], default='png', help='png8 writes palette PNGs (see encode_png).')
+    render.add_argument('--threads', action='store_true', help='Use worker threads instead of processes.')
+    render.add_argument('--pixel-scale', type=float, help='Resolution factor for specs that do not set one (e.g. 4 for print).')
+    render.add_argument('-q', '--quiet', action='store_true', help='Do not print the throughput summary.')
+
+    sheet = commands.add_parser('sheet', help='Render a sheet spec file to one image.')
+    sheet.add_argument('sheet', help='JSON or YAML sheet file.')
+    sheet.add_argument('-o', '--output', default='sheet.png', help='Output .png or .svg file.')
+    sheet.add_argument('--pixel-scale', type=float, help='Resolution factor (e.g. 4 for print).')
+    sheet.add_argument('--dpi', type=int, help='Resolution recorded in the PNG.')
+
+    animate = commands.add_parser('animate', help='Render a sheet spec file as an animation.')
+    animate.add_argument('sheet', help='JSON or YAML sheet file.')
+    animate.add_argument('-o', '--output', default='sheet.gif', help='Output .gif, .png (APNG) or .webp file.')
+    animate.add_argument('--duration', type=int, default=1000, help='Display time of each frame in ms.')
+    animate.add_argument('--loop', type=int, default=0, help='Number of loops, 0 for forever.')
+
+    catalogue = commands.add_parser('catalogue', help='Build or update the scale catalogue, re-rendering only what changed.')
+    catalogue.add_argument('output_dir', help='Catalogue directory (holds the manifest).')
+    catalogue.add_argument('--scales', nargs='+', help='Scales to include (default: all registered scales).')
+    catalogue.add_argument('--roots', nargs='+', help='Root notes to include (default: all 12).')
+    catalogue.add_argument('--no-modes', action='store_true', help='Leave out the modes.')
+    catalogue.add_argument('--no-inversions', action='store_true', help='Leave out the inversions.')
+    catalogue.add_argument('--no-arpeggios', action='store_true', help='Leave out the degree arpeggios.')
+    catalogue.add_argument('--format', choices=['png', 'png8', 'svg'], default='png')
+    catalogue.add_argument('-w', '--workers', type=int, help='Number of worker processes (default: CPU count).')
+    catalogue.add_argument('--threads', action='store_true', help='Use worker threads instead of processes.')
+    catalogue.add_argument('-q', '--quiet', action='store_true', help='Do not list the rendered files.')
+
+    server = commands.add_parser('serve', help='Run the HTTP rendering service.')
+    server.add_argument('port', nargs='?', type=int, default=8000)
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--cache-dir', default='fretboard_cache')
+    server.add_argument('-w', '--workers', type=int)
+    server.add_argument('--threads', action='store_true', help='Render in worker threads instead of processes.')
+
+    commands.add_parser('examples', help='Show the example diagrams.')
+
+    args = parser.parse_args(argv)
+    if args.command == 'render':
+        return run_render(args)
+    if args.command == 'sheet':
+        return run_sheet(args)
+    if args.command == 'animate':
+        return run_animate(args)
+    if args.command == 'catalogue':
+        return run_catalogue(args)
+    if args.command == 'serve':
+        serve(args.host, args.port, args.cache_dir, workers=args.workers, executor='thread' if args.threads else 'process')
+        return 0
+    examples()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())